@@ -24,67 +24,1920 @@
 #     ]
 # }
 
-# The script will run the container for each date, in series.
+# The dates and every date range are merged into a single chronological plan generated as the dates are needed.
+# Overlapping ranges and dates inside ranges are normalized into merged intervals, so a date listed more than once is
+# only run once, and the number of runs saved is reported at the end. With numpy installed, dates a fixed "delta"
+# apart (weeks, days, hours, minutes or seconds) are generated and formatted in chunks by numpy, see bench_dates.py.
+
+# Setting "order" (or --order) dispatches the dates in another order than chronological: "reverse" or "newest-first"
+# runs the most recent data first, "interleaved" or "bisecting" runs the first and last dates and then ever finer
+# midpoints so the whole period is covered early, and "longest-first" starts the dates whose runs took longest
+# according to the journal first, shortening the tail of the batch.
+
+# The script will run the containers for each date, in series. Setting "max_parallel" (or passing --parallel N) runs up to N
+# dates concurrently, while the run_data containers for each individual date are still run in order. All docker commands
+# are supervised from a single asyncio event loop, so a large number of containers can be in flight at once.
+
+# run_data is validated up front (env files have to exist, mounts have to be [source, destination] pairs), and the
+# launch arguments of each step are built once, with only CUSTOM_DATE and the container name set per run. Env files
+# are read once and again only when they change; the docker CLI is still given them with --env-file so their values
+# never appear on its command line, while the api backend sends the parsed values. CUSTOM_DATE and the other per run
+# variables always take precedence over the step's env.
+
+# Run_data entries can declare the files they produce as "outputs" path templates, and the files they read as
+# "inputs", where {date} is the date and {date:%Y/%m} formats it differently, e.g. "/data/maps/{date:%Y}/{date}.tif".
+# A date is skipped for a step when all of its outputs exist and none is older than its newest input, so re-running a
+# config only does the missing or outdated dates. Pass --force to run them anyway.
+
+# "batch_run.py gaps CONFIG" lists the dates every step is still missing as intervals, counting a date as done for a
+# step when the journal records it as successful or its declared outputs are up to date. With --output PATH it writes
+# a copy of the config with just the missing dates, and with --run it runs them straight away (resuming from the
+# journal, so steps that are already done for a date are not rerun).
+
+# Setting "adaptive": true (or passing --adaptive) lets each host adjust how many containers it runs at once instead of
+# always running as many as the limits allow. Every "interval" seconds (default 30) it looks at the runs completed per
+# minute, the share that failed, and for local hosts the load average per cpu and the pressure stall information in
+# /proc/pressure. The limit starts at "min" (default 1) and doubles while every slot is busy, then grows by one up to
+# "max" (default the sum of the step concurrencies). It is halved when more than "failure_rate" (default 0.25) of the
+# runs failed, the load per cpu is over "load" (default 1.5) or a pressure is over "pressure" percent (default 25),
+# and steps back when raising it lowered the throughput. Every change is printed with the reason and measurements.
+# These settings go in an object, e.g. "adaptive": {"min": 2, "max": 32, "interval": 60}.
+
+# Containers are started through the docker CLI by default. Setting "backend": "api" (or passing --backend api) talks to
+# the Docker Engine API over the unix socket in DOCKER_HOST (default /var/run/docker.sock) with persistent connections
+# instead, avoiding a docker CLI process for every run, wait and remove.
+
+# By default each run_data entry waits for the one before it. Entries can instead declare an "id" and a "depends_on"
+# list of ids, in which case the entries for a date run as a dependency graph and entries whose dependencies have all
+# finished are started concurrently, e.g. two aggregations feeding a single ingestion:
+#     {"id": "rainfall", "container": "...", "depends_on": [], "envs": {...}},
+#     {"id": "temperature", "container": "...", "depends_on": [], "envs": {...}},
+#     {"container": "ghcr.io/hcdp/task-ingest-values:latest", "depends_on": ["rainfall", "temperature"], "envs": {...}}
+# An entry without an "id" can be referred to by its position in run_data.
+
+# Setting "journal" to a file path (or passing --journal PATH) appends a JSON line with the date, step id, container,
+# the pinned image it ran as, exit code and duration of every finished run. Re-running with --resume skips the (date, step) pairs the journal
+# records as successful, so an interrupted backfill only redoes the remaining work. Dates every step has completed are
+# left out of the plan altogether.
+
+# Setting "cache_dir" (or passing --cache-dir DIR) keeps a record of every successful run keyed on a hash of the image
+# digest, env variables (including CUSTOM_DATE), env file contents and mounts. Runs with identical inputs are skipped
+# on later batches unless --ignore-cache is passed. The least recently used records are evicted once there are more
+# than "cache_size" (default 100000).
+
+# Each run_data entry can set "concurrency" to limit how many of its containers run at once (default max_parallel).
+# With "pipeline": true (or --pipeline) the steps act as stages of an assembly line: dates are admitted as long as
+# a stage has room, so date N+1 runs its first step while date N is still running its second.
+
+# Run_data entries can declare the "cpus" (e.g. 4 or 0.5) and "memory" (e.g. "8g") their containers need. These are
+# passed to docker run as --cpus/--memory limits, and runs are only started while their requirements fit in the
+# budget set by "cpus" and "memory" at the top level (or --cpus/--memory, defaulting to the host's cpus and memory),
+# so heavy mapping steps and light ingestion steps can share the host without oversubscribing it.
+
+# A run fails when its container exits with a non-zero code or docker itself fails. Run_data entries can set "retries"
+# (default 0) to rerun failed containers after "backoff" seconds (default 10), doubling the wait on each retry. What
+# happens once the retries are exhausted is controlled by "on_failure" (top level or per entry, or --on-failure):
+# "continue" (default) runs the remaining steps as usual, "skip-date" skips the remaining steps of that date, and
+# "abort" fails the batch: no new dates are started and runs still waiting for a slot, resources or a retry are
+# cancelled, while the containers already running finish. Failed runs are listed at the end and the exit status is 1.
+
+# A summary of run durations per step and the overall dates/hour is printed at the end of the batch. Setting "metrics"
+# (or --metrics PATH) also writes a record per container run with its date, step, image (as configured and as pinned),
+# exit code, queue time (spent waiting for a stage or resources), and start and end times, as CSV if the path ends in
+# .csv and JSON lines otherwise.
+
+# For tasks that can process several dates in one invocation, a run_data entry can set "batch_size" to run its
+# container once per batch of that many dates instead of once per date. Batched containers get CUSTOM_DATES (a comma
+# separated list of the dates) instead of CUSTOM_DATE, and the steps depending on them continue per date once the batch
+# finishes. When the dates of a batch are consecutive dates of the plan it also gets CUSTOM_DATE_START and
+# CUSTOM_DATE_END; dates skipped by --resume or up to date outputs, or dispatched in another --order, can leave gaps in
+# a batch, which then only gets CUSTOM_DATES.
+
+# For images that can be driven with docker exec, a run_data entry can set "warm_workers" to the number of long-lived
+# containers to start for it and "exec_command" to the command that processes a date, e.g. ["python3", "/app/run.py"].
+# The workers are started once with their entrypoint replaced by "keepalive_command" (default ["sleep", "infinity"])
+# and the step's env, mounts and limits, and each date is run with docker exec setting CUSTOM_DATE, avoiding the
+# container creation and teardown for every date. The workers are removed at the end of the batch.
+
+# Before the first date runs, every distinct image in run_data is pulled in parallel and resolved to its immutable
+# digest, and all dates run against that digest even if the tag moves during the batch. Set "pull": false (or pass
+# --no-pull) to skip this and run the tags as they are.
+
+# Setting "hosts" to a list of docker hosts spreads the dates over several machines. Entries are DOCKER_HOST style
+# endpoints ("unix:///var/run/docker.sock", "tcp://10.0.0.5:2375", or "ssh://user@host" with the cli backend), or
+# objects with a "host" and their own "max_parallel", "cpus" and "memory" (defaulting to the top level settings, and
+# for the budget to what the host's daemon reports). Each host takes contiguous shards of "shard_size" dates (default
+# its number of dates in flight) as it needs them, and once all dates are handed out idle hosts steal the later half
+# of the remaining dates of the busiest host. All steps of a date run on the same host.
+
+# Finished containers are kept for inspection and removed in bulk by a background task once more than "max_stored" are
+# kept or they are older than "max_age" seconds. Setting "keep": "failures" (or --keep failures) removes successful
+# containers right away and only keeps the failed ones. Setting "max_failed" keeps up to that many failed containers
+# (and their logs) apart from the successful ones, so a long batch of successful runs cannot push them out.
+
+# Setting "log_dir" (or --log-dir DIR) streams the stdout and stderr of every run into DIR/<date>_<step id>.log as the
+# container writes it, so the output survives the container's removal. Retried runs append to the same file. Setting
+# "log_compression" to "gzip" or "zstd" (the latter needs the zstandard package) compresses the files on the fly.
 
 import argparse
+import asyncio
+import csv
+import gzip
+import hashlib
+import heapq
 import json
+import os
+import re
 import subprocess
-from datetime import datetime
+import sys
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
-from time import time_ns
-from math import inf
+from itertools import islice
+from time import time, time_ns
+from math import ceil, inf
+from urllib.parse import urlencode
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 def parse_date_range(date_range):
     start_date, end_date = date_range.split('_')
     return start_date, end_date
 
-def generate_dates(start_date, end_date, delta, date_format):
-    current_date = datetime.strptime(start_date, date_format)
-    end_date = datetime.strptime(end_date, date_format)
+def generate_dates(start_date, end_date, step):
+    current_date = start_date
     while current_date <= end_date:
-        yield current_date.strftime(date_format)
-        current_date += relativedelta(**delta)
-
-def run_containers(date, run_data, dry_run, container_ids, max_containers):
-    for data in run_data:
-        container = data["container"]
-        env_data = []
-        envs = data["envs"]
-        variable_envs = envs.get("variables")
-        file_envs = envs.get("files")
-        mounts = data.get("mounts")
-        if mounts is not None:
-            for src, dst in mounts:
-                env_data += ["-v", f"{src}:{dst}"]
-        if variable_envs is not None:
-            for variable in variable_envs:
-                env_data += ["-e", f"{variable}={variable_envs[variable]}"]
-        if file_envs is not None:
-            for file in file_envs:
-                env_data.append(f"--env-file={file}")
-        print(f'Running container {container} with CUSTOM_DATE={date} at {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}')
-        if not dry_run:
-            container_name = f"batch_{date}_{time_ns()}"
-            args = ['docker', 'run', '-d', f'--name={container_name}', '-e', f'CUSTOM_DATE={date}'] + env_data + [container]
-            subprocess.run(args, check=True, stderr=subprocess.STDOUT)
-            subprocess.run(['docker', 'wait', container_name], check=True, stderr=subprocess.STDOUT)
-
-            container_ids.append(container_name)
-            #remove the oldest container if over the max allowed number of containers have been executed
-            if(len(container_ids) > max_containers):
-                removed_name = container_ids.pop(0)
-                subprocess.run(['docker', 'rm', removed_name], check=True, stderr=subprocess.STDOUT)
-
-def main():
-    parser = argparse.ArgumentParser(description='Run a container repeatedly with the given list of CUSTOM_DATE env vars.')
+        yield current_date
+        current_date += step
+
+#deltas in these units are a fixed length of time, unlike months and years
+FIXED_DELTA_UNITS = {"weeks", "days", "hours", "minutes", "seconds"}
+
+ISO_FIELDS = {"Y": range(0, 4), "m": range(5, 7), "d": range(8, 10), "H": range(11, 13), "M": range(14, 16), "S": range(17, 19)}
+
+def iso_columns(date_format):
+    #maps a format built from the fixed width fields of an ISO timestamp to the positions of their characters in one,
+    #with literal characters kept as strings, or None if the format uses anything else
+    columns = []
+    i = 0
+    while i < len(date_format):
+        if date_format[i] != "%":
+            columns.append(date_format[i])
+            i += 1
+            continue
+        field = date_format[i + 1:i + 2]
+        if field == "%":
+            columns.append("%")
+        elif field in ISO_FIELDS:
+            columns.extend(ISO_FIELDS[field])
+        else:
+            return None
+        i += 2
+    return columns
+
+def generate_dates_numpy(start_date, end_date, step, date_format, chunk_size=4096):
+    #fixed steps are generated and formatted a chunk at a time by numpy instead of one date at a time in python, by
+    #rearranging the characters of the ISO timestamps into the date format
+    columns = iso_columns(date_format)
+    step = np.timedelta64(step)
+    start = np.datetime64(start_date, "us")
+    end = np.datetime64(end_date, "us")
+    while start <= end:
+        values = np.arange(start, min(end, start + step * (chunk_size - 1)) + step, step)
+        values = values[values <= end]
+        dates = values.tolist()
+        if columns is None:
+            labels = [date.strftime(date_format) for date in dates]
+        else:
+            chars = np.datetime_as_string(values, unit="s").astype("U19").view("U1").reshape(len(values), 19)
+            formatted = np.empty((len(values), len(columns)), dtype="U1")
+            for i, column in enumerate(columns):
+                formatted[:, i] = column if isinstance(column, str) else chars[:, column]
+            labels = formatted.view(f"U{len(columns)}").ravel().tolist()
+        yield from zip(dates, labels)
+        start = values[-1] + step
+
+def parse_env(text):
+    #follows the docker --env-file format: KEY=VALUE lines, comments and blank lines ignored, a bare KEY is read from
+    #the current environment
+    env = {}
+    for line in text.splitlines():
+        line = line.lstrip()
+        if line == "" or line.startswith("#"):
+            continue
+        key, sep, value = line.partition("=")
+        if sep:
+            env[key] = value
+        elif key in os.environ:
+            env[key] = os.environ[key]
+    return env
+
+class EnvFiles:
+    #env files are parsed once and only read again when their modification time or size changes, keeping a hash of
+    #their contents so launch templates and cache keys can tell whether they really changed
+    def __init__(self):
+        self.files = {}
+
+    def load(self, path):
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        file = self.files.get(path)
+        if file is None or file["version"] != version:
+            with open(path, "rb") as f:
+                content = f.read()
+            file = {"version": version, "env": parse_env(content.decode()), "digest": hashlib.sha256(content).hexdigest()}
+            self.files[path] = file
+        return file
+
+class DockerCLIBackend:
+    def __init__(self, host=None):
+        #any DOCKER_HOST style endpoint the CLI supports, including ssh://, or the CLI's own default
+        self.command = ['docker'] + (['-H', host] if host is not None else [])
+
+    async def docker(self, *args, capture=False):
+        stdout = asyncio.subprocess.PIPE if capture else None
+        process = await asyncio.create_subprocess_exec(*self.command, *args, stdout=stdout, stderr=asyncio.subprocess.STDOUT)
+        output, _ = await process.communicate()
+        if process.returncode != 0:
+            #only the subcommand, the full arguments can hold env values
+            raise subprocess.CalledProcessError(process.returncode, [*self.command, args[0]], output)
+        return output
+
+    def template(self, image, env_files, variables, mounts, cpus=None, memory=None, command=None):
+        #the arguments every run of a step shares. The env files are passed with --env-file so their values stay off
+        #the command line, and docker gives the -e variables precedence over them
+        args = []
+        if command is not None:
+            args.append(f"--entrypoint={command[0]}")
+        if cpus is not None:
+            args.append(f"--cpus={cpus}")
+        if memory is not None:
+            args.append(f"--memory={memory}")
+        for src, dst in mounts:
+            args += ["-v", f"{src}:{dst}"]
+        for path, _ in env_files:
+            args.append(f"--env-file={path}")
+        for key, value in variables.items():
+            args += ["-e", f"{key}={value}"]
+        return {"args": args, "command": [image, *(command[1:] if command is not None else [])]}
+
+    async def run(self, name, template, variables):
+        #the per run variables come after the step's variables, so they take precedence
+        args = ['run', '-d', f'--name={name}', *template["args"]]
+        for variable in variables:
+            args += ["-e", f"{variable}={variables[variable]}"]
+        await self.docker(*args, *template["command"])
+
+    async def exec(self, name, command, variables, output=None):
+        args = [*self.command, 'exec']
+        for variable in variables:
+            args += ["-e", f"{variable}={variables[variable]}"]
+        if output is None:
+            process = await asyncio.create_subprocess_exec(*args, name, *command, stderr=asyncio.subprocess.STDOUT)
+        else:
+            process = await asyncio.create_subprocess_exec(*args, name, *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+            await copy_stream(process.stdout, output)
+        #docker exec exits with the exit code of the command
+        return await process.wait()
+
+    async def logs(self, name, output):
+        #follows the container's stdout and stderr until it exits
+        args = [*self.command, 'logs', '--follow', name]
+        process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        await copy_stream(process.stdout, output)
+        if await process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, args)
+
+    async def wait(self, name):
+        output = await self.docker('wait', name, capture=True)
+        return int(output.decode().strip())
+
+    async def remove(self, *names, force=False):
+        await self.docker('rm', *(['-f'] if force else []), *names)
+
+    async def pull(self, image):
+        await self.docker('pull', '--quiet', image, capture=True)
+
+    async def inspect_image(self, image):
+        try:
+            output = await self.docker('image', 'inspect', image, capture=True)
+        except subprocess.CalledProcessError:
+            return None
+        return json.loads(output)[0]
+
+    async def info(self):
+        return json.loads(await self.docker('info', '--format={{json .}}', capture=True))
+
+    async def close(self):
+        pass
+
+class DockerAPIError(Exception):
+    def __init__(self, method, path, status, message):
+        super().__init__(f"{method} {path} returned {status}: {message}")
+        self.status = status
+
+class DockerAPIBackend:
+    def __init__(self, endpoint):
+        if endpoint.startswith("unix://"):
+            self.socket_path = endpoint[len("unix://"):]
+            self.address = None
+        elif endpoint.startswith("tcp://"):
+            self.socket_path = None
+            host, _, port = endpoint[len("tcp://"):].rstrip("/").rpartition(":")
+            self.address = (host, int(port))
+        else:
+            raise ValueError(f"The api backend only supports unix:// and tcp:// docker hosts, got {endpoint}")
+        #idle keep-alive connections, reused so each request does not pay for a new connection
+        self.connections = []
+
+    async def connect(self):
+        if self.socket_path is not None:
+            return await asyncio.open_unix_connection(self.socket_path)
+        return await asyncio.open_connection(*self.address)
+
+    async def request(self, method, path, query=None, body=None, raw=False):
+        if query:
+            path = f"{path}?{urlencode(query)}"
+        payload = b"" if body is None else json.dumps(body).encode()
+        message = (
+            f"{method} {path} HTTP/1.1\r\nHost: docker\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+        )
+        #a pooled connection the daemon closed while it sat idle fails before any of the response arrives, the
+        #request is then sent once more on a new connection
+        for fresh in (not self.connections, True):
+            reader, writer = await self.connect() if fresh else self.connections.pop()
+            head = None
+            try:
+                writer.write(message)
+                await writer.drain()
+                head = await read_http_head(reader)
+                data = b"".join([chunk async for chunk in iter_http_body(reader, *head)])
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                if not fresh and head is None and not getattr(e, "partial", b""):
+                    continue
+                raise ConnectionError(f"Lost the connection to the docker daemon during {method} {path}") from e
+            except BaseException:
+                writer.close()
+                raise
+            break
+        status, headers = head
+        if headers.get("connection", "").lower() == "close":
+            writer.close()
+        else:
+            self.connections.append((reader, writer))
+        if status >= 400:
+            try:
+                message = json.loads(data).get("message", "")
+            except ValueError:
+                message = data.decode(errors="replace")
+            raise DockerAPIError(method, path, status, message)
+        if raw:
+            return data
+        return json.loads(data) if data else None
+
+    async def pull(self, image):
+        #the pull progress is a stream of JSON messages, and failures are reported in it rather than by the status
+        #without a tag the engine pulls every tag of the repository, so like the CLI an untagged image means latest
+        repository, tag = split_reference(image)
+        data = await self.request("POST", "/images/create", {"fromImage": repository, "tag": tag}, raw=True)
+        for line in data.splitlines():
+            if line.strip():
+                message = json.loads(line)
+                if "error" in message:
+                    raise DockerAPIError("POST", "/images/create", 500, message["error"])
+
+    def template(self, image, env_files, variables, mounts, cpus=None, memory=None, command=None):
+        #the create request every run of a step shares, the engine API has no --env-file so the env is set directly
+        env = {}
+        for _, file_env in env_files:
+            env.update(file_env)
+        env.update(variables)
+        body = {
+            "Image": image,
+            "HostConfig": {"Binds": [f"{src}:{dst}" for src, dst in mounts]}
+        }
+        if cpus is not None:
+            body["HostConfig"]["NanoCpus"] = int(cpus * 1e9)
+        if memory is not None:
+            body["HostConfig"]["Memory"] = memory
+        if command is not None:
+            body["Entrypoint"] = command[:1]
+            body["Cmd"] = command[1:]
+        return {"body": body, "env": env}
+
+    async def run(self, name, template, variables):
+        #the per run variables take precedence over the step's env, as with -e over --env-file on the CLI
+        body = dict(template["body"])
+        body["Env"] = [f"{key}={value}" for key, value in {**template["env"], **variables}.items()]
+        image = body["Image"]
+        try:
+            await self.request("POST", "/containers/create", {"name": name}, body)
+        except DockerAPIError as e:
+            #like docker run, pull the image if it is not available locally
+            if e.status != 404:
+                raise
+            await self.pull(image)
+            await self.request("POST", "/containers/create", {"name": name}, body)
+        await self.request("POST", f"/containers/{name}/start")
+
+    async def wait(self, name):
+        result = await self.request("POST", f"/containers/{name}/wait")
+        return result["StatusCode"]
+
+    async def remove(self, *names, force=False):
+        query = {"force": "1"} if force else None
+        await asyncio.gather(*(self.request("DELETE", f"/containers/{name}", query) for name in names))
+
+    async def exec(self, name, command, variables, output=None):
+        body = {
+            "Cmd": command,
+            "Env": [f"{key}={value}" for key, value in variables.items()],
+            "AttachStdout": True,
+            "AttachStderr": True
+        }
+        exec_id = (await self.request("POST", f"/containers/{name}/exec", body=body))["Id"]
+        async for payload in self.stream("POST", f"/exec/{exec_id}/start", {"Detach": False, "Tty": False}):
+            (output or sys.stdout.buffer).write(payload)
+        if output is None:
+            sys.stdout.flush()
+        result = await self.request("GET", f"/exec/{exec_id}/json")
+        return result["ExitCode"]
+
+    async def logs(self, name, output):
+        #follows the container's stdout and stderr until it exits
+        query = {"follow": "1", "stdout": "1", "stderr": "1"}
+        async for payload in self.stream("GET", f"/containers/{name}/logs?{urlencode(query)}"):
+            output.write(payload)
+
+    async def stream(self, method, path, body=None):
+        #an attached exec or followed log holds its connection until the process exits, so it gets a connection of
+        #its own, and the multiplexed output is yielded as it arrives
+        reader, writer = await self.connect()
+        try:
+            payload = json.dumps(body).encode() if body is not None else b""
+            writer.write(
+                f"{method} {path} HTTP/1.1\r\nHost: docker\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+            status, headers = await read_http_head(reader)
+            if status >= 400:
+                data = b"".join([chunk async for chunk in iter_http_body(reader, status, headers)])
+                raise DockerAPIError(method, path, status, data.decode(errors="replace"))
+            async for _, payload in demux_docker_stream(iter_http_body(reader, status, headers)):
+                yield payload
+        except asyncio.IncompleteReadError as e:
+            raise ConnectionError(f"Lost the connection to the docker daemon during {method} {path}") from e
+        finally:
+            writer.close()
+
+    async def inspect_image(self, image):
+        try:
+            return await self.request("GET", f"/images/{image}/json")
+        except DockerAPIError as e:
+            if e.status != 404:
+                raise
+            return None
+
+    async def info(self):
+        return await self.request("GET", "/info")
+
+    async def close(self):
+        for reader, writer in self.connections:
+            writer.close()
+        self.connections = []
+
+async def read_http_head(reader):
+    status_line = await reader.readuntil(b"\r\n")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readuntil(b"\r\n")
+        if line == b"\r\n":
+            break
+        key, _, value = line.decode().partition(":")
+        headers[key.strip().lower()] = value.strip()
+    return status, headers
+
+async def iter_http_body(reader, status, headers):
+    #yields the body as it arrives, so streamed responses never have to be held in memory
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            chunk = await reader.readexactly(size + 2)
+            if size == 0:
+                break
+            yield chunk[:-2]
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        while remaining > 0:
+            chunk = await reader.read(min(remaining, 65536))
+            if not chunk:
+                raise asyncio.IncompleteReadError(chunk, remaining)
+            remaining -= len(chunk)
+            yield chunk
+    elif status not in (204, 304):
+        headers["connection"] = "close"
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            yield chunk
+
+async def demux_docker_stream(chunks):
+    #containers without a tty have their stdout and stderr multiplexed into frames with an 8 byte header holding the
+    #stream type and payload length
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= 8:
+            length = int.from_bytes(buffer[4:8], "big")
+            if len(buffer) < 8 + length:
+                break
+            yield buffer[0], buffer[8:8 + length]
+            buffer = buffer[8 + length:]
+
+async def copy_stream(reader, output):
+    while True:
+        chunk = await reader.read(65536)
+        if not chunk:
+            break
+        output.write(chunk)
+
+LOG_COMPRESSIONS = ["none", "gzip", "zstd"]
+
+def open_log(path, compression):
+    #opened for appending so the output of retried runs follows the earlier attempts, gzip members and zstd frames
+    #can be concatenated and still decompress as one stream
+    if compression == "gzip":
+        return gzip.open(f"{path}.gz", "ab")
+    if compression == "zstd":
+        return zstandard.ZstdCompressor().stream_writer(open(f"{path}.zst", "ab"))
+    return open(path, "ab")
+
+def make_backend(backend, host=None):
+    if backend == "cli":
+        return DockerCLIBackend(host)
+    if backend == "api":
+        return DockerAPIBackend(host or os.environ.get("DOCKER_HOST", "unix:///var/run/docker.sock"))
+    raise ValueError(f"Unknown backend {backend}, expected cli or api")
+
+MEMORY_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4, "p": 1024 ** 5}
+#the sizes docker accepts: a number, optionally followed by a space and a binary unit written as k, kb, kib, and so on
+MEMORY_SIZE = re.compile(r"(\d+(?:\.\d+)?) ?([kmgtp]?)i?b?", re.IGNORECASE)
+
+def parse_memory(memory):
+    #docker style memory sizes, e.g. 512m, 4g, 8gb or 512MiB, or a plain number of bytes
+    if isinstance(memory, (int, float)):
+        return int(memory)
+    match = MEMORY_SIZE.fullmatch(memory.strip())
+    if match is None:
+        raise ValueError(f"Invalid memory size {memory!r}, expected bytes or a size like 512m, 8gb or 4GiB")
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2).lower()])
+
+def host_memory():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return inf
+
+class ResourcePool:
+    #hands out cpu and memory reservations against a fixed budget. Waiting runs are served in order, but smaller runs
+    #may overtake a run that does not fit yet so the budget stays busy, up to MAX_BYPASS times before it is reserved
+    #for the waiting run
+    MAX_BYPASS = 16
+
+    def __init__(self, cpus, memory):
+        self.cpus = cpus
+        self.memory = memory
+        self.free_cpus = cpus
+        self.free_memory = memory
+        self.waiters = []
+        self.bypassed = 0
+
+    def fits(self, cpus, memory):
+        return cpus <= self.free_cpus and memory <= self.free_memory
+
+    async def acquire(self, cpus, memory):
+        waiter = (cpus, memory, asyncio.get_running_loop().create_future())
+        self.waiters.append(waiter)
+        self.grant()
+        try:
+            await waiter[2]
+        except asyncio.CancelledError:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            elif not waiter[2].cancelled():
+                self.release(cpus, memory)
+            raise
+
+    def release(self, cpus, memory):
+        self.free_cpus += cpus
+        self.free_memory += memory
+        self.grant()
+
+    def grant(self):
+        i = 0
+        while i < len(self.waiters):
+            cpus, memory, future = self.waiters[i]
+            if self.fits(cpus, memory) and (i == 0 or self.bypassed < self.MAX_BYPASS):
+                self.free_cpus -= cpus
+                self.free_memory -= memory
+                del self.waiters[i]
+                future.set_result(None)
+                self.bypassed = 0 if i == 0 else self.bypassed + 1
+            else:
+                i += 1
+
+class AdjustableLimit:
+    #a semaphore whose limit can be changed while it is in use, lowering it lets the current holders finish. It notes
+    #whether the limit was reached, which tells the adaptive controller the limit is what holds the runs back
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.waiters = []
+        self.saturated = False
+
+    async def __aenter__(self):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        self.grant()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future in self.waiters:
+                self.waiters.remove(future)
+            elif not future.cancelled():
+                self.release()
+            raise
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    def release(self):
+        self.active -= 1
+        self.grant()
+
+    def resize(self, limit):
+        self.limit = limit
+        self.grant()
+
+    def grant(self):
+        while self.waiters and self.active < self.limit:
+            self.active += 1
+            self.waiters.pop(0).set_result(None)
+        if self.waiters or self.active >= self.limit:
+            self.saturated = True
+
+PRESSURE_RESOURCES = ("cpu", "memory", "io")
+
+def read_pressure():
+    #the share of the last 10 seconds in which some task was stalled on each resource, from the linux pressure stall
+    #information, empty on kernels without it
+    pressure = {}
+    for resource in PRESSURE_RESOURCES:
+        try:
+            with open(f"/proc/pressure/{resource}") as f:
+                for line in f:
+                    kind, *fields = line.split()
+                    if kind == "some":
+                        pressure[resource] = float(dict(field.split("=") for field in fields)["avg10"])
+        except OSError:
+            pass
+    return pressure
+
+class AdaptiveController:
+    #adjusts how many containers a host runs at once from what it observes every interval: the runs completed per
+    #minute, the share of them that failed and, on local hosts, the load average and pressure stall information. The
+    #limit starts at min and doubles while all slots are busy, then grows by one at a time (additive increase). It is
+    #halved when too many runs fail or the host is under pressure (multiplicative decrease), and steps back when
+    #raising it lowered the throughput
+    def __init__(self, host, options):
+        self.host = host
+        self.minimum = options.get("min", 1)
+        self.maximum = options.get("max", sum(host.stage_sizes.values()))
+        self.interval = options.get("interval", 30)
+        self.max_failure_rate = options.get("failure_rate", 0.25)
+        self.max_pressure = options.get("pressure", 25)
+        self.max_load = options.get("load", 1.5)
+        self.completed = 0
+        self.failed = 0
+        self.throughput = None
+        self.previous_limit = self.minimum
+        self.raised = False
+        self.slow_start = True
+        self.task = None
+        host.running.resize(self.minimum)
+
+    def record(self, succeeded):
+        self.completed += 1
+        if not succeeded:
+            self.failed += 1
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.adjust()
+
+    def adjust(self):
+        running = self.host.running
+        limit = running.limit
+        throughput = self.completed * 60 / self.interval
+        failure_rate = self.failed / self.completed if self.completed else 0
+        signals = [f"{throughput:.1f} runs/min", f"{failure_rate:.0%} failed"]
+        problems = []
+        if failure_rate > self.max_failure_rate:
+            problems.append("too many runs failed")
+        if self.host.local:
+            load = os.getloadavg()[0] / (os.cpu_count() or 1)
+            signals.append(f"load {load:.2f} per cpu")
+            if load > self.max_load:
+                problems.append("the load average is high")
+            for resource, value in read_pressure().items():
+                signals.append(f"{resource} pressure {value:.1f}%")
+                if value > self.max_pressure:
+                    problems.append(f"{resource} pressure is high")
+        if problems:
+            new_limit = max(self.minimum, limit // 2)
+            reason = " and ".join(problems)
+            self.slow_start = False
+        elif self.raised and throughput < self.throughput * 0.95:
+            new_limit = self.previous_limit
+            reason = "raising the limit lowered the throughput"
+            self.slow_start = False
+        elif running.saturated:
+            new_limit = min(self.maximum, limit * 2 if self.slow_start else limit + 1)
+            reason = "every slot was busy"
+        else:
+            new_limit = limit
+            reason = None
+        self.raised = new_limit > limit
+        self.previous_limit = limit
+        self.throughput = throughput
+        self.completed = 0
+        self.failed = 0
+        running.saturated = False
+        if new_limit != limit or problems:
+            running.resize(new_limit)
+            print(f'Adaptive concurrency{self.host.label}: {limit} -> {new_limit} containers, {reason} ({", ".join(signals)})')
+
+ON_FAILURE_POLICIES = ("abort", "skip-date", "continue")
+
+def compile_steps(run_data):
+    #steps default to depending on the previous entry in run_data, so plain lists keep running in order
+    steps = []
+    for i, data in enumerate(run_data):
+        step = dict(data)
+        step["id"] = str(data.get("id", i))
+        envs = data.get("envs", {})
+        step["variables"] = dict(envs.get("variables", {}))
+        step["env_files"] = list(envs.get("files", []))
+        for path in step["env_files"]:
+            if not os.path.isfile(path):
+                raise ValueError(f"run_data step {step['id']} env file {path} does not exist")
+        step["mounts"] = [tuple(mount) for mount in data.get("mounts", [])]
+        for key in ("outputs", "inputs"):
+            paths = data.get(key, [])
+            step[key] = [paths] if isinstance(paths, str) else list(paths)
+        if step["inputs"] and not step["outputs"]:
+            raise ValueError(f"run_data step {step['id']} declares inputs but no outputs to compare them with")
+        for mount in step["mounts"]:
+            if len(mount) != 2:
+                raise ValueError(f"run_data step {step['id']} mount {list(mount)} is not a [source, destination] pair")
+        step["cpus"] = float(data["cpus"]) if "cpus" in data else None
+        step["memory"] = parse_memory(data["memory"]) if "memory" in data else None
+        step["batch_size"] = data.get("batch_size", 1)
+        step["warm_workers"] = data.get("warm_workers", 0)
+        step["keepalive_command"] = data.get("keepalive_command", ["sleep", "infinity"])
+        if step["warm_workers"] and "exec_command" not in data:
+            raise ValueError(f"run_data step {step['id']} sets warm_workers but has no exec_command to run in them")
+        step["retries"] = data.get("retries", 0)
+        step["backoff"] = data.get("backoff", 10)
+        if step.get("on_failure", "continue") not in ON_FAILURE_POLICIES:
+            raise ValueError(f"run_data step {step['id']} has unknown on_failure policy {step['on_failure']}")
+        if "depends_on" in data:
+            step["depends_on"] = [str(dep) for dep in data["depends_on"]]
+        else:
+            step["depends_on"] = [steps[-1]["id"]] if steps else []
+        steps.append(step)
+    ids = [step["id"] for step in steps]
+    for step in steps:
+        if ids.count(step["id"]) > 1:
+            raise ValueError(f"Duplicate run_data id {step['id']}")
+        for dep in step["depends_on"]:
+            if dep not in ids:
+                raise ValueError(f"run_data step {step['id']} depends on unknown step {dep}")
+    #order the steps so every step comes after its dependencies, keeping the run_data order where possible
+    ordered = []
+    done = set()
+    while len(ordered) < len(steps):
+        ready = [step for step in steps if step["id"] not in done and all(dep in done for dep in step["depends_on"])]
+        if not ready:
+            cycle = [step["id"] for step in steps if step["id"] not in done]
+            raise ValueError(f"run_data steps {', '.join(cycle)} have circular dependencies")
+        ordered.append(ready[0])
+        done.add(ready[0]["id"])
+    return ordered
+
+class DatePlan:
+    #the dates of a batch in chronological order, generated lazily: the ranges are normalized into merged intervals,
+    #the explicit dates and the intervals are merged as sorted streams, a date listed more than once is run once, and
+    #dates inside the completed intervals are left out, so a plan of millions of dates costs memory per range rather
+    #than per date and the first date is ready at once
+    def __init__(self, dates, date_ranges, delta, date_format, completed=()):
+        #fixed deltas are stepped with plain timedelta arithmetic, which also allows generating them with numpy
+        self.step = timedelta(**delta) if set(delta) <= FIXED_DELTA_UNITS else relativedelta(**delta)
+        self.date_format = date_format
+        #dates that would have been run more than once
+        self.duplicates = 0
+        self.ranges = self.normalize(tuple(datetime.strptime(date, date_format) for date in parse_date_range(date_range)) for date_range in date_ranges)
+        self.dates = sorted(date for date in (datetime.strptime(date, date_format) for date in dates) if not self.covered(date))
+        self.completed = self.intervals(datetime.strptime(date, date_format) for date in completed)
+        self.skipped = 0
+
+    def aligned(self, start_date, date):
+        #whether stepping from start_date reaches date
+        if isinstance(self.step, timedelta):
+            return (date - start_date) % self.step == timedelta(0)
+        last = None
+        for last in generate_dates(start_date, date, self.step):
+            pass
+        return last == date
+
+    def count(self, start_date, end_date):
+        if isinstance(self.step, timedelta):
+            return max((end_date - start_date) // self.step + 1, 0)
+        return sum(1 for _ in generate_dates(start_date, end_date, self.step))
+
+    def normalize(self, ranges):
+        #merges the ranges that overlap or follow each other on the same grid of dates into single intervals, so the
+        #dates they share are generated once
+        merged = []
+        for start_date, end_date in sorted(ranges):
+            if end_date < start_date:
+                continue
+            for interval in merged:
+                if start_date <= interval[1] + self.step and self.aligned(interval[0], start_date):
+                    self.duplicates += self.count(start_date, min(end_date, interval[1]))
+                    interval[1] = max(interval[1], end_date)
+                    break
+            else:
+                merged.append([start_date, end_date])
+        return merged
+
+    def covered(self, date):
+        for start_date, end_date in self.ranges:
+            if start_date <= date <= end_date and self.aligned(start_date, date):
+                self.duplicates += 1
+                return True
+        return False
+
+    def intervals(self, dates):
+        #coalesces dates into (first, last) runs of consecutive dates
+        intervals = []
+        for date in sorted(dates):
+            if intervals and intervals[-1][1] + self.step == date:
+                intervals[-1][1] = date
+            else:
+                intervals.append([date, date])
+        return intervals
+
+    def range_dates(self, start_date, end_date):
+        #the dates of a range with their formatted labels
+        if np is not None and isinstance(self.step, timedelta):
+            yield from generate_dates_numpy(start_date, end_date, self.step, self.date_format)
+        else:
+            for date in generate_dates(start_date, end_date, self.step):
+                yield date, date.strftime(self.date_format)
+
+    def __iter__(self):
+        for _, label in self.entries():
+            yield label
+
+    def entries(self):
+        #the planned dates with their formatted labels
+        streams = [[(date, date.strftime(self.date_format)) for date in self.dates]]
+        streams += [self.range_dates(start_date, end_date) for start_date, end_date in self.ranges]
+        completed = iter(self.completed)
+        interval = next(completed, None)
+        previous = None
+        for date, label in heapq.merge(*streams):
+            if date == previous:
+                self.duplicates += 1
+                continue
+            previous = date
+            #the dates come sorted, so the completed intervals are walked alongside them
+            while interval is not None and interval[1] < date:
+                interval = next(completed, None)
+            if interval is not None and interval[0] <= date:
+                self.skipped += 1
+                continue
+            yield date, label
+
+ORDERS = ["chronological", "reverse", "newest-first", "interleaved", "bisecting", "longest-first"]
+
+def bisecting_order(n):
+    #the first and last index, then the midpoints of ever smaller intervals, so the dates run so far always cover the
+    #whole plan evenly
+    if n > 0:
+        yield 0
+    if n > 1:
+        yield n - 1
+    intervals = deque([(0, n - 1)])
+    while intervals:
+        lo, hi = intervals.popleft()
+        if hi - lo < 2:
+            continue
+        mid = (lo + hi) // 2
+        yield mid
+        intervals.append((lo, mid))
+        intervals.append((mid, hi))
+
+def order_dates(plan, order, durations=None):
+    #any order other than chronological needs the whole plan, so the plan is only generated up front for those
+    if order == "chronological":
+        return iter(plan)
+    dates = list(plan)
+    if order in ("reverse", "newest-first"):
+        dates.reverse()
+    elif order in ("interleaved", "bisecting"):
+        dates = [dates[i] for i in bisecting_order(len(dates))]
+    elif order == "longest-first":
+        #dates that have not run before are expected to take as long as the average date that has
+        known = [durations[date] for date in dates if date in durations]
+        average = sum(known) / len(known) if known else 0
+        dates.sort(key=lambda date: durations.get(date, average), reverse=True)
+    return iter(dates)
+
+class Journal:
+    #append-only JSON lines record of every finished container run, used to resume interrupted batches
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.completed = set()
+        #how long the last run of every (date, step) took
+        self.durations = {}
+        self.file = None
+        line = "\n"
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        #a partially written last line from a crash, the run will just be redone
+                        continue
+                    if record["exit_code"] == 0:
+                        self.completed.add((record["date"], record["step"]))
+                    if record["name"] is not None:
+                        self.durations[(record["date"], record["step"])] = record["duration"]
+        if readonly:
+            return
+        self.file = open(path, "a")
+        if not line.endswith("\n"):
+            self.file.write("\n")
+
+    def is_completed(self, date, step_id):
+        return (date, step_id) in self.completed
+
+    def date_durations(self):
+        #the total time the steps of each date took on their last runs
+        durations = {}
+        for (date, _), duration in self.durations.items():
+            durations[date] = durations.get(date, 0) + duration
+        return durations
+
+    def completed_dates(self, step_ids):
+        #the dates every one of the steps has completed for
+        dates = {date for date, _ in self.completed}
+        return [date for date in dates if all((date, step_id) in self.completed for step_id in step_ids)]
+
+    def record(self, date, step_id, container, image, name, exit_code, duration):
+        #container is the image as configured and image the pinned reference that actually ran
+        record = {
+            "date": date,
+            "step": step_id,
+            "container": container,
+            "image": image,
+            "name": name,
+            "exit_code": exit_code,
+            "duration": round(duration, 3)
+        }
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        if exit_code == 0:
+            self.completed.add((date, step_id))
+
+    def close(self):
+        self.file.close()
+
+class TemplateDate(str):
+    #a date in path templates, {date} is the date as it is passed to the container and {date:%Y/%m} reformats it
+    def __new__(cls, label, date):
+        value = super().__new__(cls, label)
+        value.date = date
+        return value
+
+    def __format__(self, spec):
+        return self.date.strftime(spec) if spec else str(self)
+
+class OutputChecker:
+    #make style checks of the outputs steps declare. Every directory is listed once with os.scandir and the listing is
+    #reused for all dates, instead of a stat per file per date
+    def __init__(self, date_format):
+        self.date_format = date_format
+        self.listings = {}
+
+    def paths(self, templates, date):
+        value = TemplateDate(date, datetime.strptime(date, self.date_format))
+        return [template.format(date=value) for template in templates]
+
+    def mtime(self, path):
+        directory, name = os.path.split(os.path.abspath(path))
+        listing = self.listings.get(directory)
+        if listing is None:
+            listing = {}
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        listing[entry.name] = entry
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+            self.listings[directory] = listing
+        entry = listing.get(name)
+        return entry.stat().st_mtime if entry is not None else None
+
+    def up_to_date(self, date, step):
+        #all outputs exist and none is older than the newest input
+        if not step["outputs"]:
+            return False
+        outputs = [self.mtime(path) for path in self.paths(step["outputs"], date)]
+        inputs = [self.mtime(path) for path in self.paths(step["inputs"], date)]
+        if None in outputs or None in inputs:
+            return False
+        return not inputs or max(inputs) <= min(outputs)
+
+    def invalidate(self, dates, step):
+        #a run rewrites its outputs, so their directories are listed again for the steps reading them
+        for date in dates:
+            for path in self.paths(step["outputs"], date):
+                self.listings.pop(os.path.dirname(os.path.abspath(path)), None)
+
+class ResultCache:
+    #successful runs keyed on a hash of everything that goes into them, evicting the least recently used entries once
+    #there are more than max_entries
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(path, exist_ok=True)
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.endswith(".json"):
+                    entries.append((entry.stat().st_mtime, entry.name[:-len(".json")]))
+        self.entries = OrderedDict((key, None) for _, key in sorted(entries))
+        self.evict()
+
+    @staticmethod
+    def make_key(digest, variables, env_file_digests, mounts):
+        key_data = {
+            "image": digest,
+            "variables": variables,
+            "env_files": env_file_digests,
+            "mounts": [[src, dst] for src, dst in mounts]
+        }
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, f"{key}.json")
+
+    def contains(self, key):
+        if key not in self.entries:
+            return False
+        try:
+            os.utime(self.entry_path(key))
+        except FileNotFoundError:
+            del self.entries[key]
+            return False
+        self.entries.move_to_end(key)
+        return True
+
+    def add(self, key, date, step_id, container):
+        with open(self.entry_path(key), "w") as f:
+            json.dump({"date": date, "step": step_id, "container": container, "created": time()}, f)
+        self.entries[key] = None
+        self.entries.move_to_end(key)
+        self.evict()
+
+    def evict(self):
+        while len(self.entries) > self.max_entries:
+            key, _ = self.entries.popitem(last=False)
+            try:
+                os.remove(self.entry_path(key))
+            except FileNotFoundError:
+                pass
+
+def percentile(values, p):
+    #nearest-rank percentile of a sorted list
+    return values[max(0, ceil(p / 100 * len(values)) - 1)]
+
+class Metrics:
+    #per-run timing records, written as JSON lines or as CSV if the path ends in .csv, plus a summary for the batch
+    FIELDS = ["date", "step", "container", "image", "name", "host", "attempt", "exit_code", "queued", "start", "end", "queue_time", "duration"]
+
+    def __init__(self, path=None):
+        self.file = None
+        self.csv = None
+        if path is not None:
+            self.file = open(path, "a", newline="")
+            if path.endswith(".csv"):
+                self.csv = csv.DictWriter(self.file, self.FIELDS)
+                if self.file.tell() == 0:
+                    self.csv.writeheader()
+        self.durations = {}
+        self.queue_times = {}
+        self.dates = 0
+        self.started = time()
+
+    def record(self, date, step_id, container, image, name, host, attempt, exit_code, queued, start, end):
+        record = {
+            "date": date,
+            "step": step_id,
+            "container": container,
+            "image": image,
+            "name": name,
+            "host": host,
+            "attempt": attempt,
+            "exit_code": exit_code,
+            "queued": round(queued, 3),
+            "start": round(start, 3),
+            "end": round(end, 3),
+            "queue_time": round(start - queued, 3),
+            "duration": round(end - start, 3)
+        }
+        if self.csv is not None:
+            self.csv.writerow(record)
+        elif self.file is not None:
+            self.file.write(json.dumps(record) + "\n")
+        if self.file is not None:
+            self.file.flush()
+        self.durations.setdefault(step_id, []).append(end - start)
+        self.queue_times.setdefault(step_id, []).append(start - queued)
+
+    def summary(self):
+        elapsed = time() - self.started
+        lines = [f"Ran {self.dates} dates in {elapsed:.1f} seconds ({self.dates / elapsed * 3600:.1f} dates/hour)"]
+        for step_id, durations in self.durations.items():
+            durations = sorted(durations)
+            queue_times = sorted(self.queue_times[step_id])
+            lines.append(
+                f"    step {step_id}: {len(durations)} runs, duration p50 {percentile(durations, 50):.1f}s "
+                f"p95 {percentile(durations, 95):.1f}s max {durations[-1]:.1f}s, "
+                f"queue time p50 {percentile(queue_times, 50):.1f}s max {queue_times[-1]:.1f}s"
+            )
+        return lines
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+def split_reference(image):
+    #the repository and the tag or digest of an image reference, the tag defaulting to latest
+    name, at, digest = image.partition("@")
+    if at:
+        return name, digest
+    repository, _, tag = name.rpartition(":")
+    if repository and "/" not in tag:
+        return repository, tag
+    return name, "latest"
+
+def pinned_reference(image, inspect):
+    #the repo@sha256 digest the tag currently points to, or the image id for images that were never pushed or pulled
+    if "@" in image:
+        return image
+    repository, _ = split_reference(image)
+    for repo_digest in inspect.get("RepoDigests") or []:
+        if repo_digest.split("@")[0] == repository:
+            return repo_digest
+    return inspect["Id"]
+
+def failure_reason(error):
+    #a failed docker command is reported by its exit status, its arguments and output can hold env values
+    if isinstance(error, subprocess.CalledProcessError):
+        return f"docker {error.cmd[-1]} exited with code {error.returncode}"
+    return str(error)
+
+def date_label(dates):
+    return dates[0] if len(dates) == 1 else f"{dates[0]}_{dates[-1]}"
+
+def describe_dates(dates, batched=False):
+    if not batched:
+        return f"CUSTOM_DATE={dates[0]}"
+    if len(dates) == 1:
+        return f"CUSTOM_DATES={dates[0]}"
+    return f"CUSTOM_DATES={dates[0]} to {dates[-1]} ({len(dates)} dates)"
+
+class WarmPool:
+    #long-lived containers for a step that are started once and then fed dates with docker exec, instead of creating
+    #a new container for every date
+    def __init__(self, backend, step, host):
+        self.backend = backend
+        self.step = step
+        self.host = host
+        self.workers = None
+        self.names = []
+        self.started = None
+
+    async def start(self):
+        step = self.step
+        template = self.host.template(step, step["keepalive_command"])
+        self.names = [f"batch_warm_{step['id']}_{i}_{time_ns()}" for i in range(step["warm_workers"])]
+        await asyncio.gather(*(self.backend.run(name, template, {}) for name in self.names))
+        self.workers = asyncio.Queue()
+        for name in self.names:
+            self.workers.put_nowait(name)
+
+    async def exec(self, variables, on_start, output=None):
+        #the workers are started on first use, by whichever run gets here first
+        if self.started is None:
+            self.started = asyncio.ensure_future(self.start())
+        await self.started
+        name = await self.workers.get()
+        try:
+            on_start(name)
+            return await self.backend.exec(name, self.step["exec_command"], variables, output)
+        finally:
+            self.workers.put_nowait(name)
+
+    async def stop(self):
+        if self.names:
+            await self.backend.remove(*self.names, force=True)
+
+class DateBatcher:
+    #collects the dates reaching a batched step and runs them through a single container once batch_size dates have
+    #arrived, or once every date that could still arrive is already waiting
+    def __init__(self, size, run, key=None):
+        self.size = size
+        self.run = run
+        #batches are passed in date order even when the dates are dispatched in another order
+        self.key = key
+        self.dates = []
+        self.future = None
+        #dates admitted to the batch that have not got past this step yet, with the order they were admitted in so
+        #batches are passed in plan order even if the dates reach this step out of order
+        self.pending = {}
+        self.admitted = 0
+        self.finished = False
+        #the running batches, the event loop only keeps weak references to tasks
+        self.tasks = set()
+
+    def admit(self, date):
+        self.pending[date] = self.admitted
+        self.admitted += 1
+
+    def passed(self, date):
+        del self.pending[date]
+        self.check()
+
+    def finish(self):
+        self.finished = True
+        self.check()
+
+    async def add(self, date):
+        if not self.dates:
+            self.future = asyncio.get_running_loop().create_future()
+        future = self.future
+        self.dates.append(date)
+        self.check()
+        return await asyncio.shield(future)
+
+    def check(self):
+        if self.dates and (len(self.dates) >= self.size or (self.finished and len(self.dates) >= len(self.pending))):
+            dates = sorted(self.dates, key=self.key or self.pending.__getitem__)
+            future = self.future
+            self.dates = []
+            self.future = None
+
+            def set_result(task):
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+
+            task = asyncio.create_task(self.run(dates))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            task.add_done_callback(set_result)
+
+RETENTION_POLICIES = ["all", "failures"]
+
+class ContainerCleaner:
+    #keeps the most recently finished containers for inspection and removes the evicted ones in bulk from a
+    #background task, so no run waits on a removal. Containers are evicted once more than max_stored are kept, once
+    #they are older than max_age seconds, and right away if they succeeded and only failures are kept. With max_failed
+    #set, failed containers are kept separately up to that many, so successful runs never push them out
+    def __init__(self, backend, max_stored=inf, max_age=None, keep="all", max_failed=None):
+        self.backend = backend
+        self.max_age = max_age
+        self.keep = keep
+        #finish time and name of the kept containers, oldest first
+        self.retained = deque()
+        self.failed = deque() if max_failed is not None else self.retained
+        self.limits = [(self.retained, max_stored)]
+        if max_failed is not None:
+            self.limits.append((self.failed, max_failed))
+        self.evicted = []
+        #made with the task on the running loop, as before Python 3.10 asyncio primitives bind to the loop current
+        #when they are created and main builds the cleaner before asyncio.run
+        self.wakeup = None
+        self.task = None
+        self.closed = False
+
+    def add(self, name, exit_code):
+        if exit_code != 0:
+            self.failed.append((time(), name))
+        elif self.keep == "failures":
+            self.evicted.append(name)
+        else:
+            self.retained.append((time(), name))
+        self.expire()
+        if self.task is None:
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.ensure_future(self.clean())
+        if self.evicted:
+            self.wakeup.set()
+
+    def expire(self):
+        for retained, limit in self.limits:
+            while len(retained) > limit:
+                self.evicted.append(retained.popleft()[1])
+            if self.max_age is not None:
+                cutoff = time() - self.max_age
+                while retained and retained[0][0] < cutoff:
+                    self.evicted.append(retained.popleft()[1])
+
+    async def clean(self):
+        #containers evicted while a removal is running are removed together by the next one
+        while not self.closed:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.max_age)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            self.expire()
+            await self.remove_evicted()
+
+    async def remove_evicted(self):
+        names, self.evicted = self.evicted, []
+        if not names:
+            return
+        try:
+            await self.backend.remove(*names)
+        except (subprocess.CalledProcessError, DockerAPIError, OSError) as e:
+            print(f'Could not remove {len(names)} containers: {e}')
+
+    async def close(self):
+        self.closed = True
+        if self.task is not None:
+            self.wakeup.set()
+            await self.task
+        self.expire()
+        await self.remove_evicted()
+
+class RunFailedError(Exception):
+    pass
+
+def budget_error(steps, resources):
+    for step in steps:
+        if (step["cpus"] or 0) > resources.cpus or (step["memory"] or 0) > resources.memory:
+            return f"run_data step {step['id']} requires more cpus or memory than the budget of {resources.cpus} cpus and {resources.memory} bytes"
+    return None
+
+class Host:
+    #a docker host the batch runs on, with its own limits, resource budget, warm workers and retained containers
+    def __init__(self, name, backend, steps, max_parallel, resources=None, pipeline=False, label="", local=True):
+        self.name = name
+        self.backend = backend
+        self.max_parallel = max_parallel
+        self.resources = resources
+        self.label = label
+        #whether the host's load and pressure can be read from this machine
+        self.local = local
+        #every step is a stage with its own limit on concurrently running containers
+        self.stage_sizes = {step["id"]: step.get("concurrency", max_parallel) for step in steps}
+        #their semaphores are made once the batch runs, see run_host
+        self.stage_limits = {}
+        #pipelined dates are admitted as long as any stage could take them, instead of max_parallel whole dates at a time
+        self.date_window = sum(self.stage_sizes.values()) if pipeline else max_parallel
+        #the limit on all containers running on the host, only lowered by the adaptive controller
+        self.running = AdjustableLimit(inf)
+        self.controller = None
+        self.warm_pools = {step["id"]: WarmPool(backend, step, self) for step in steps if step["warm_workers"]}
+        self.batchers = {}
+        self.cleaner = None
+        self.env_files = None
+        self.templates = {}
+        #the image reference each run_data container runs as on this host, and the image ids used for cache keys
+        self.images = {step["container"]: step["container"] for step in steps}
+        self.image_digests = {}
+        #dates sharded to this host that have not started yet
+        self.queue = deque()
+        #the tasks of runs waiting for a slot, resources or a retry, cancelled if the batch is aborted
+        self.waiting = set()
+
+    def template(self, step, command=None):
+        #the launch arguments of a step are built once and only rebuilt when the contents of one of its env files change
+        files = [(path, self.env_files.load(path)) for path in step["env_files"]]
+        version = [file["digest"] for _, file in files]
+        key = (step["id"], command is not None)
+        cached = self.templates.get(key)
+        if cached is None or cached[0] != version:
+            env_files = [(path, file["env"]) for path, file in files]
+            cached = (version, self.backend.template(self.images[step["container"]], env_files, step["variables"], step["mounts"], step["cpus"], step["memory"], command))
+            self.templates[key] = cached
+        return cached[1]
+
+    async def close(self):
+        if self.controller is not None:
+            await self.controller.stop()
+        await asyncio.gather(*(pool.stop() for pool in self.warm_pools.values()))
+        await self.cleaner.close()
+        await self.backend.close()
+
+class BatchRunner:
+    def __init__(self, steps, hosts, dry_run=False, max_containers=inf, journal=None, resume=False, cache=None, ignore_cache=False, on_failure="continue", metrics=None, pull=True, shard_size=None, max_age=None, keep="all", max_failed=None, log_dir=None, log_compression="none", outputs=None, date_key=None, adaptive=None, date_step=None):
+        self.steps = steps
+        self.hosts = hosts
+        self.dry_run = dry_run
+        self.journal = journal
+        self.resume = resume
+        self.cache = cache
+        self.ignore_cache = ignore_cache
+        self.on_failure = on_failure
+        self.pull = pull
+        self.shard_size = shard_size
+        self.log_dir = log_dir
+        self.log_compression = log_compression
+        self.outputs = outputs
+        self.date_key = date_key
+        self.date_step = date_step
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.failures = []
+        self.aborted = False
+        self.env_files = EnvFiles()
+        for host in hosts:
+            host.cleaner = ContainerCleaner(host.backend, max_containers, max_age, keep, max_failed)
+            host.env_files = self.env_files
+            if adaptive is not None and not dry_run:
+                host.controller = AdaptiveController(host, adaptive)
+            for step in steps:
+                if step["batch_size"] > 1:
+                    host.batchers[step["id"]] = DateBatcher(step["batch_size"], lambda dates, step=step, host=host: self.execute_step(host, dates, step), date_key)
+                    #enough dates have to be in flight to fill every batch at once, or the batches would wait on each other
+                    host.date_window += step["batch_size"]
+
+    async def pin_images(self):
+        #pull every image once up front, in parallel, and run all dates against the digest it resolved to, so a tag
+        #moving mid-batch cannot mix image versions and no pulls happen between runs. The digests are resolved on the
+        #first host and the other hosts pull exactly those digests
+        images = sorted({step["container"] for step in self.steps})
+
+        async def pin(host, image, reference):
+            try:
+                await host.backend.pull(reference)
+            except (subprocess.CalledProcessError, DockerAPIError) as e:
+                print(f'Could not pull {reference}{host.label}, using the local image if there is one: {e}')
+            except OSError as e:
+                #the daemon is unreachable or the docker CLI is missing, so there is no local image to fall back on
+                raise RunFailedError(f'Could not pull {reference}{host.label}: {e}')
+            try:
+                inspect = await host.backend.inspect_image(reference)
+            except (DockerAPIError, OSError) as e:
+                raise RunFailedError(f'Could not inspect {reference}{host.label}: {e}')
+            if inspect is None:
+                raise RunFailedError(f'Image {reference} could not be pulled and is not available locally{host.label}')
+            return pinned_reference(reference, inspect)
+
+        first, *others = self.hosts
+        pinned = dict(zip(images, await asyncio.gather(*(pin(first, image, image) for image in images))))
+        for image, reference in pinned.items():
+            print(f'Pinned {image} to {reference}')
+        await asyncio.gather(*(pin(host, image, reference) for host in others for image, reference in pinned.items()))
+        for host in self.hosts:
+            host.images = dict(pinned)
+
+    async def set_budgets(self):
+        #hosts without a configured budget use the cpus and memory their docker daemon reports
+        for host in self.hosts:
+            if host.resources is None:
+                try:
+                    info = await host.backend.info()
+                except (subprocess.CalledProcessError, DockerAPIError, OSError) as e:
+                    raise RunFailedError(f"Could not get the cpus and memory{host.label}: {e}")
+                host.resources = ResourcePool(info["NCPU"], info["MemTotal"])
+                error = budget_error(self.steps, host.resources)
+                if error is not None:
+                    raise RunFailedError(f"{error}{host.label}")
+
+    async def cache_key(self, host, image, variables, step):
+        #the digest is looked up once per image for the batch, an image that is not available locally yet gets no key
+        digest = host.image_digests.get(image)
+        if digest is None:
+            inspect = await host.backend.inspect_image(image)
+            if inspect is None:
+                return None
+            digest = inspect["Id"]
+            host.image_digests[image] = digest
+        env_file_digests = [[path, self.env_files.load(path)["digest"]] for path in step["env_files"]]
+        return ResultCache.make_key(digest, variables, env_file_digests, step["mounts"])
+
+    async def run_container(self, host, dates, step, variables, attempt):
+        container = step["container"]
+        label = date_label(dates)
+        cpus = step["cpus"] or 0
+        memory = step["memory"] or 0
+        queued = time()
+        #until it has its slots and resources the run is cancelled if the batch is aborted
+        waiting = self.start_waiting(host)
+        try:
+            async with host.stage_limits[step["id"]], host.running:
+                await host.resources.acquire(cpus, memory)
+                host.waiting.discard(waiting)
+                log = logs = None
+                try:
+                    print(f'Running container {container} with {describe_dates(dates, step["batch_size"] > 1)}{host.label} at {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}')
+                    if self.dry_run:
+                        return 0
+                    if self.log_dir is not None:
+                        log = open_log(os.path.join(self.log_dir, f"{label}_{step['id']}.log"), self.log_compression)
+                    if step["id"] in host.warm_pools:
+                        #the rest of the env is set on the worker
+                        worker = []
+                        start = time()
+                        exit_code = await host.warm_pools[step["id"]].exec(variables, worker.append, log)
+                        end = time()
+                        container_name = worker[0]
+                    else:
+                        container_name = f"batch_{label}_{time_ns()}"
+                        start = time()
+                        await host.backend.run(container_name, host.template(step), variables)
+                        if log is not None:
+                            logs = asyncio.ensure_future(self.capture_logs(host, container_name, log))
+                        exit_code = await host.backend.wait(container_name)
+                        end = time()
+                        if logs is not None:
+                            await logs
+                finally:
+                    if logs is not None and not logs.done():
+                        logs.cancel()
+                    if log is not None:
+                        log.close()
+                    host.resources.release(cpus, memory)
+        finally:
+            host.waiting.discard(waiting)
+        if self.journal is not None:
+            for date in dates:
+                self.journal.record(date, step["id"], container, host.images[container], container_name, exit_code, end - start)
+        self.metrics.record(label, step["id"], container, host.images[container], container_name, host.name, attempt, exit_code, queued, start, end)
+        if step["id"] in host.warm_pools:
+            return exit_code
+
+        host.cleaner.add(container_name, exit_code)
+        return exit_code
+
+    def start_waiting(self, host):
+        #runs waiting for a slot, resources or a retry are cancelled when the batch is aborted, containers already
+        #running are left to finish
+        if self.aborted:
+            raise asyncio.CancelledError()
+        task = asyncio.current_task()
+        host.waiting.add(task)
+        return task
+
+    def abort(self):
+        self.aborted = True
+        for host in self.hosts:
+            for task in list(host.waiting):
+                task.cancel()
+
+    async def capture_logs(self, host, name, log):
+        #streamed to the file as the container writes it, so the logs outlive the container
+        try:
+            await host.backend.logs(name, log)
+        except (subprocess.CalledProcessError, DockerAPIError, OSError) as e:
+            print(f'Could not capture the logs of container {name}: {e}')
+
+    def contiguous(self, dates):
+        #whether the dates are consecutive dates of the plan
+        if self.date_key is None or self.date_step is None:
+            return False
+        parsed = [self.date_key(date) for date in dates]
+        return all(previous + self.date_step == date for previous, date in zip(parsed, parsed[1:]))
+
+    async def execute_step(self, host, dates, step):
+        #returns whether the step succeeded, retrying failed runs with exponential backoff
+        container = step["container"]
+        #only the date variables are set per run, the rest of the env is part of the step's launch template
+        if step["batch_size"] > 1:
+            date_variables = {"CUSTOM_DATES": ",".join(dates)}
+            #dates skipped or dispatched out of order leave gaps in a batch, which then has no range to describe it
+            if self.contiguous(dates):
+                date_variables["CUSTOM_DATE_START"] = dates[0]
+                date_variables["CUSTOM_DATE_END"] = dates[-1]
+        else:
+            date_variables = {"CUSTOM_DATE": dates[0]}
+        variables = {**step["variables"], **date_variables}
+        cache_key = None
+        if self.cache is not None and not self.dry_run:
+            cache_key = await self.cache_key(host, host.images[container], variables, step)
+            if not self.ignore_cache and cache_key is not None and self.cache.contains(cache_key):
+                print(f'Skipping container {container} with {describe_dates(dates, step["batch_size"] > 1)}, cached result with identical inputs')
+                if self.journal is not None:
+                    for date in dates:
+                        self.journal.record(date, step["id"], container, host.images[container], None, 0, 0)
+                return True
+        for attempt in range(step["retries"] + 1):
+            if attempt > 0:
+                delay = step["backoff"] * 2 ** (attempt - 1)
+                print(f'Retrying container {container} with {describe_dates(dates, step["batch_size"] > 1)} in {delay} seconds (attempt {attempt + 1} of {step["retries"] + 1})')
+                waiting = self.start_waiting(host)
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    host.waiting.discard(waiting)
+            try:
+                exit_code = await self.run_container(host, dates, step, date_variables, attempt + 1)
+            except (subprocess.CalledProcessError, DockerAPIError, OSError) as e:
+                exit_code = None
+                reason = failure_reason(e)
+            if host.controller is not None:
+                host.controller.record(exit_code == 0)
+            if exit_code == 0:
+                if self.outputs is not None and step["outputs"]:
+                    self.outputs.invalidate(dates, step)
+                if self.cache is not None and not self.dry_run:
+                    if cache_key is None:
+                        cache_key = await self.cache_key(host, host.images[container], variables, step)
+                    if cache_key is not None:
+                        self.cache.add(cache_key, date_label(dates), step["id"], container)
+                return True
+            if exit_code is not None:
+                reason = f"exited with code {exit_code}"
+            print(f'Container {container} with {describe_dates(dates, step["batch_size"] > 1)}{host.label} failed: {reason}')
+        self.failures.append((date_label(dates), step["id"], reason))
+        return False
+
+    async def run_step(self, host, date, step):
+        if self.resume and self.journal.is_completed(date, step["id"]):
+            print(f'Skipping container {step["container"]} with CUSTOM_DATE={date}, already completed')
+            return True
+        if self.outputs is not None and self.outputs.up_to_date(date, step):
+            print(f'Skipping container {step["container"]} with CUSTOM_DATE={date}, outputs are up to date')
+            return True
+        if step["id"] in host.batchers:
+            return await host.batchers[step["id"]].add(date)
+        return await self.execute_step(host, [date], step)
+
+    async def run_containers(self, host, date):
+        #each step starts as soon as the steps it depends on have finished, so independent steps run concurrently
+        tasks = {}
+        skip_date = False
+
+        async def run_after_dependencies(step):
+            nonlocal skip_date
+            try:
+                await asyncio.gather(*(tasks[dep] for dep in step["depends_on"]))
+                if skip_date:
+                    print(f'Skipping container {step["container"]} with CUSTOM_DATE={date}, an earlier step failed')
+                    return
+                if not await self.run_step(host, date, step):
+                    on_failure = step.get("on_failure", self.on_failure)
+                    if on_failure == "abort":
+                        self.abort()
+                        raise RunFailedError(f'Step {step["id"]} failed for CUSTOM_DATE={date}, aborting the batch')
+                    if on_failure == "skip-date":
+                        skip_date = True
+            finally:
+                if step["id"] in host.batchers:
+                    host.batchers[step["id"]].passed(date)
+
+        for step in self.steps:
+            tasks[step["id"]] = asyncio.create_task(run_after_dependencies(step))
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    def next_date(self, host, date_iter):
+        #dates are handed out to the hosts in contiguous shards as they need them, and once the plan is exhausted an
+        #idle host steals the later half of the not yet started dates of the host with the most left
+        if not host.queue:
+            host.queue.extend(islice(date_iter, self.shard_size or host.date_window))
+        if not host.queue:
+            victim = max(self.hosts, key=lambda other: len(other.queue))
+            for _ in range((len(victim.queue) + 1) // 2):
+                host.queue.appendleft(victim.queue.pop())
+        return host.queue.popleft() if host.queue else None
+
+    async def run_host(self, host, date_iter, failed):
+        #made on the running loop, before Python 3.10 asyncio primitives bind to the loop current when they are created
+        host.stage_limits = {step_id: asyncio.Semaphore(size) for step_id, size in host.stage_sizes.items()}
+        if host.controller is not None:
+            host.controller.start()
+        slots = asyncio.Semaphore(host.date_window)
+        tasks = set()
+
+        def on_done(task):
+            tasks.discard(task)
+            slots.release()
+            if not task.cancelled() and task.exception() is not None:
+                failed.append(task.exception())
+
+        #dates are only taken once a slot frees up so large ranges are never materialized
+        while True:
+            await slots.acquire()
+            date = None if failed or self.aborted else self.next_date(host, date_iter)
+            if date is None:
+                slots.release()
+                break
+            self.metrics.dates += 1
+            for batcher in host.batchers.values():
+                batcher.admit(date)
+            task = asyncio.create_task(self.run_containers(host, date))
+            task.add_done_callback(on_done)
+            tasks.add(task)
+        for batcher in host.batchers.values():
+            batcher.finish()
+        if tasks:
+            await asyncio.wait(tasks)
+        if host.controller is not None:
+            await host.controller.stop()
+
+    async def run_dates(self, date_iter):
+        failed = []
+        try:
+            if not self.dry_run:
+                await self.set_budgets()
+                if self.pull:
+                    await self.pin_images()
+            await asyncio.gather(*(self.run_host(host, date_iter, failed) for host in self.hosts))
+        finally:
+            await asyncio.gather(*(host.close() for host in self.hosts))
+            if self.journal is not None:
+                self.journal.close()
+            self.metrics.close()
+        if failed:
+            raise failed[0]
+
+def find_gaps(plan, steps, journal=None, outputs=None):
+    #the dates each step still has to run for, as intervals of consecutive dates of the plan, plus the intervals of
+    #dates any step has to run for. A date is done for a step if the journal records it as successful or the outputs
+    #the step declares are up to date
+    gaps = {step["id"]: [] for step in steps}
+    gaps[None] = []
+
+    def add(intervals, date, label):
+        if intervals and intervals[-1][1] + plan.step == date:
+            intervals[-1][1] = date
+            intervals[-1][3] = label
+            intervals[-1][4] += 1
+        else:
+            intervals.append([date, date, label, label, 1])
+
+    for date, label in plan.entries():
+        missing = False
+        for step in steps:
+            if journal is not None and journal.is_completed(label, step["id"]):
+                continue
+            if outputs is not None and outputs.up_to_date(label, step):
+                continue
+            add(gaps[step["id"]], date, label)
+            missing = True
+        if missing:
+            add(gaps[None], date, label)
+    return gaps
+
+def interval_label(interval):
+    return interval[2] if interval[4] == 1 else f"{interval[2]}_{interval[3]}"
+
+def use_pidfd_child_watcher():
+    #before 3.12 asyncio waits on every docker CLI process with a thread of its own, on linux a pidfd lets the event
+    #loop wait on them instead
+    if sys.platform != "linux" or not (3, 9) <= sys.version_info < (3, 12):
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        #kernels before 5.3 have no pidfd
+        return
+    asyncio.set_child_watcher(asyncio.PidfdChildWatcher())
+
+def gaps_main(argv):
+    parser = argparse.ArgumentParser(prog='batch_run.py gaps', description='List the dates each run_data step is still missing, according to the journal and the outputs the steps declare.')
+    parser.add_argument('data', help='JSON file specifying the containers, env data, and dates to run with')
+    parser.add_argument('-j', '--journal', help='Journal of the earlier runs (overrides journal in the JSON file)')
+    parser.add_argument('-o', '--output', help='Write a copy of the JSON file that only runs the missing dates to this file')
+    parser.add_argument('--run', action='store_true', help='Run the missing dates straight away, resuming from the journal')
+    args = parser.parse_args(argv)
+
+    with open(args.data) as f:
+        data = json.load(f)
+
+    try:
+        steps = compile_steps(data['run_data'])
+    except ValueError as e:
+        parser.error(str(e))
+    date_format = data.get("date_format", "%Y-%m-%d")
+    plan = DatePlan(data.get('dates', []), data.get('date_ranges', []), data.get("delta", {"days": 1}), date_format)
+    journal_path = args.journal or data.get("journal")
+    journal = Journal(journal_path, readonly=True) if journal_path is not None else None
+    gaps = find_gaps(plan, steps, journal, OutputChecker(date_format))
+
+    for step in steps:
+        intervals = gaps[step["id"]]
+        print(f'step {step["id"]} ({step["container"]}): {sum(interval[4] for interval in intervals)} missing dates in {len(intervals)} intervals')
+        for interval in intervals:
+            print(f"    {interval_label(interval)}")
+    missing = gaps[None]
+    if not missing:
+        print("No missing dates")
+        return
+
+    #the missing dates replace the configured ones, single dates as dates and the rest as ranges
+    gap_data = dict(data)
+    gap_data["dates"] = [interval[2] for interval in missing if interval[4] == 1]
+    gap_data["date_ranges"] = [interval_label(interval) for interval in missing if interval[4] > 1]
+    if journal_path is not None:
+        gap_data["journal"] = journal_path
+    output = args.output
+    if output is None and args.run:
+        output = f"{os.path.splitext(args.data)[0]}.gaps.json"
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(gap_data, f, indent=4)
+        print(f"Wrote the {sum(interval[4] for interval in missing)} missing dates to {output}")
+    if args.run:
+        main([output] + (["--resume"] if journal_path is not None else []))
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["gaps"]:
+        return gaps_main(argv[1:])
+    parser = argparse.ArgumentParser(description='Run a container repeatedly with the given list of CUSTOM_DATE env vars.', epilog='Run "%(prog)s gaps -h" to list the dates a config is still missing.')
     parser.add_argument('data', help='JSON file specifying the containers, env data, and dates to run with')
     parser.add_argument('-d', '--dry-run', action='store_true', help='Do not run the container, just print the commands that would be run')
-    args = parser.parse_args()
+    parser.add_argument('-p', '--parallel', type=int, help='Maximum number of dates to run concurrently (overrides max_parallel in the JSON file, default 1)')
+    parser.add_argument('-b', '--backend', choices=['cli', 'api'], help='Run containers through the docker CLI or directly through the Docker Engine API socket (overrides backend in the JSON file, default cli)')
+    parser.add_argument('-j', '--journal', help='Append a record of every finished container run to this file (overrides journal in the JSON file)')
+    parser.add_argument('-r', '--resume', action='store_true', help='Skip the containers the journal records as already completed successfully for a date')
+    parser.add_argument('-c', '--cache-dir', help='Skip runs whose image, env variables, env files, mounts and date match a previous successful run recorded in this directory (overrides cache_dir in the JSON file)')
+    parser.add_argument('-o', '--order', choices=ORDERS, help='Order to dispatch the dates in, longest-first uses the durations in the journal (overrides order in the JSON file, default chronological)')
+    parser.add_argument('-a', '--adaptive', action='store_true', help='Adjust the number of containers running at once to the observed throughput, failures and host pressure (overrides adaptive in the JSON file)')
+    parser.add_argument('-f', '--force', action='store_true', help='Run steps even if the outputs they declare are up to date')
+    parser.add_argument('--ignore-cache', action='store_true', help='Run every container even if the cache has a result for it, still recording new results')
+    parser.add_argument('--pipeline', action='store_true', help='Start the first steps of later dates while earlier dates are still running their later steps, limiting each step by its concurrency')
+    parser.add_argument('--cpus', type=float, help='Number of cpus the runs can reserve in total (overrides cpus in the JSON file, default the number of host cpus)')
+    parser.add_argument('--memory', help='Amount of memory the runs can reserve in total, e.g. 64g (overrides memory in the JSON file, default the host memory)')
+    parser.add_argument('--on-failure', choices=ON_FAILURE_POLICIES, help='What to do when a container still fails after its retries (overrides on_failure in the JSON file, default continue)')
+    parser.add_argument('-m', '--metrics', help='Write timing records for every container run to this file, as CSV if it ends in .csv and JSON lines otherwise (overrides metrics in the JSON file)')
+    parser.add_argument('--keep', choices=RETENTION_POLICIES, help='Keep the last max_stored finished containers for inspection, or only the failed ones (overrides keep in the JSON file, default all)')
+    parser.add_argument('-l', '--log-dir', help='Write the output of every container run to a file per date and step in this directory (overrides log_dir in the JSON file)')
+    parser.add_argument('--log-compression', choices=LOG_COMPRESSIONS, help='Compress the log files as they are written (overrides log_compression in the JSON file, default none)')
+    parser.add_argument('--no-pull', action='store_true', help='Do not pull and pin the images before starting, run the tags as they are whenever each container starts')
+    args = parser.parse_args(argv)
 
     with open(args.data) as f:
         data = json.load(f)
 
-    run_data = data['run_data']
+    try:
+        steps = compile_steps(data['run_data'])
+    except ValueError as e:
+        parser.error(str(e))
     dates = data.get('dates', [])
     date_ranges = data.get('date_ranges', [])
     delta = data.get("delta", {
@@ -92,16 +1945,111 @@ def main():
     })
     date_format = data.get("date_format", "%Y-%m-%d")
     max_containers = data.get("max_stored", inf)
+    max_parallel = args.parallel if args.parallel is not None else data.get("max_parallel", 1)
+    if max_parallel < 1:
+        parser.error("the number of parallel dates must be at least 1")
 
-    container_ids = []
-
-    for date in dates:
-        run_containers(date, run_data, args.dry_run, container_ids, max_containers)
+    journal_path = args.journal or data.get("journal")
+    if args.resume and journal_path is None:
+        parser.error("--resume requires a journal file")
 
-    for date_range in date_ranges:
-        start_date, end_date = parse_date_range(date_range)
-        for date in generate_dates(start_date, end_date, delta, date_format):
-            run_containers(date, run_data, args.dry_run, container_ids, max_containers)
+    backend_kind = args.backend or data.get("backend", "cli")
+    pipeline = args.pipeline or data.get("pipeline", False)
+    journal = Journal(journal_path) if journal_path is not None else None
+    log_dir = args.log_dir or data.get("log_dir")
+    log_compression = args.log_compression or data.get("log_compression", "none")
+    if log_compression not in LOG_COMPRESSIONS:
+        parser.error(f"log_compression must be one of {', '.join(LOG_COMPRESSIONS)}")
+    if log_compression == "zstd" and zstandard is None:
+        parser.error("zstd log compression requires the zstandard package")
+    if log_dir is not None:
+        os.makedirs(log_dir, exist_ok=True)
+    #with --resume the dates every step has already completed are left out of the plan entirely
+    plan = DatePlan(dates, date_ranges, delta, date_format, journal.completed_dates([step["id"] for step in steps]) if args.resume else ())
+    order = args.order or data.get("order", "chronological")
+    if order not in ORDERS:
+        parser.error(f"order must be one of {', '.join(ORDERS)}")
+    if order == "longest-first" and journal is None:
+        parser.error("the longest-first order requires a journal with the durations of earlier runs")
+    cache_dir = args.cache_dir or data.get("cache_dir")
+    cache = ResultCache(cache_dir, data.get("cache_size", 100000)) if cache_dir is not None else None
+    budget_cpus = args.cpus or data.get("cpus")
+    budget_memory = args.memory or data.get("memory")
+    hosts = []
+    try:
+        if "hosts" not in data:
+            docker_host = os.environ.get("DOCKER_HOST")
+            #the cpus, memory and pressure of this machine only say something about the daemon when it runs here
+            local = docker_host is None or docker_host.startswith("unix://")
+            if local:
+                resources = ResourcePool(budget_cpus or os.cpu_count(), parse_memory(budget_memory) if budget_memory is not None else host_memory())
+            else:
+                #a remote daemon without a configured budget reports its own before the batch starts
+                resources = ResourcePool(budget_cpus, parse_memory(budget_memory)) if budget_cpus is not None and budget_memory is not None else None
+            hosts.append(Host(docker_host or "local", make_backend(backend_kind), steps, max_parallel, resources, pipeline, local=local))
+        else:
+            for entry in data["hosts"]:
+                if isinstance(entry, str):
+                    entry = {"host": entry}
+                cpus = entry.get("cpus", budget_cpus)
+                memory = entry.get("memory", budget_memory)
+                #hosts without a configured budget get the one their daemon reports before the batch starts
+                resources = ResourcePool(cpus, parse_memory(memory)) if cpus is not None and memory is not None else None
+                hosts.append(Host(entry["host"], make_backend(backend_kind, entry["host"]), steps, entry.get("max_parallel", max_parallel), resources, pipeline, f' on {entry["host"]}', local=entry["host"].startswith("unix://")))
+    except ValueError as e:
+        parser.error(str(e))
+    for host in hosts:
+        if host.resources is not None:
+            error = budget_error(steps, host.resources)
+            if error is not None:
+                parser.error(f"{error}{host.label}")
+        elif args.dry_run:
+            host.resources = ResourcePool(inf, inf)
+    adaptive = data.get("adaptive", False) or args.adaptive
+    adaptive = (adaptive if isinstance(adaptive, dict) else {}) if adaptive else None
+    runner = BatchRunner(
+        steps,
+        hosts,
+        dry_run=args.dry_run,
+        max_containers=max_containers,
+        journal=journal,
+        resume=args.resume,
+        cache=cache,
+        ignore_cache=args.ignore_cache,
+        on_failure=args.on_failure or data.get("on_failure", "continue"),
+        metrics=Metrics(args.metrics or data.get("metrics")),
+        pull=not args.no_pull and data.get("pull", True),
+        shard_size=data.get("shard_size"),
+        max_age=data.get("max_age"),
+        keep=args.keep or data.get("keep", "all"),
+        max_failed=data.get("max_failed"),
+        log_dir=log_dir,
+        log_compression=log_compression,
+        outputs=None if args.force else OutputChecker(date_format),
+        date_key=lambda date: datetime.strptime(date, date_format),
+        adaptive=adaptive,
+        date_step=plan.step
+    )
+    aborted = False
+    use_pidfd_child_watcher()
+    try:
+        asyncio.run(runner.run_dates(order_dates(plan, order, journal.date_durations() if journal is not None else None)))
+    except RunFailedError as e:
+        print(e)
+        aborted = True
+    if plan.duplicates:
+        print(f"Removed {plan.duplicates} duplicate dates from the plan, saving {plan.duplicates * len(steps)} container runs")
+    if plan.skipped:
+        print(f"Skipped {plan.skipped} dates the journal records as completed")
+    if not args.dry_run:
+        for line in runner.metrics.summary():
+            print(line)
+    if runner.failures:
+        print(f"{len(runner.failures)} runs failed:")
+        for date, step_id, reason in runner.failures:
+            print(f"    step {step_id} with CUSTOM_DATE={date}: {reason}")
+    if runner.failures or aborted:
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
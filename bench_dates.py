@@ -0,0 +1,75 @@
+# Benchmarks generating a date plan the way batch_run.py used to, with strptime, relativedelta and strftime for every
+# date, against the DatePlan generator with and without numpy, e.g.
+#     python bench_dates.py 1990-01-01T00_2024-12-31T23 --format %Y-%m-%dT%H --delta hours=1
+
+import argparse
+from datetime import datetime
+from itertools import zip_longest
+from dateutil.relativedelta import relativedelta
+from time import perf_counter
+
+import batch_run
+
+def legacy_dates(start_date, end_date, delta, date_format):
+    current_date = datetime.strptime(start_date, date_format)
+    end_date = datetime.strptime(end_date, date_format)
+    while current_date <= end_date:
+        yield current_date.strftime(date_format)
+        current_date += relativedelta(**delta)
+
+def plan_dates(date_range, delta, date_format):
+    return iter(batch_run.DatePlan([], [date_range], delta, date_format))
+
+def bench(name, dates):
+    start = perf_counter()
+    count = 0
+    last = None
+    for last in dates:
+        count += 1
+    elapsed = perf_counter() - start
+    print(f'{name}: {count} dates in {elapsed:.3f} seconds ({count / elapsed:,.0f} dates/second), last {last}')
+
+def without_numpy(dates):
+    #numpy is only hidden while a date is generated, so other generators consumed alongside this one still use it
+    dates = iter(dates)
+    while True:
+        numpy, batch_run.np = batch_run.np, None
+        try:
+            date = next(dates, None)
+        finally:
+            batch_run.np = numpy
+        if date is None:
+            return
+        yield date
+
+def compare(generators):
+    #the generators are compared date by date, so a date skipped or formatted differently anywhere is reported
+    names = list(generators)
+    for i, dates in enumerate(zip_longest(*generators.values())):
+        if len(set(dates)) != 1:
+            print(f'The generators disagree on date {i}: ' + ', '.join(f'{name} {date}' for name, date in zip(names, dates)))
+            return False
+    print('The generators agree on every date')
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the speed of the date generators on a single date range.')
+    parser.add_argument('date_range', nargs='?', default='2000-01-01T00_2024-12-31T23', help='Date range to generate, START_END in the date format')
+    parser.add_argument('--format', default='%Y-%m-%dT%H', help='Date format of the range and the generated dates')
+    parser.add_argument('--delta', default='hours=1', help='Step between dates as relativedelta keyword arguments, e.g. days=1,hours=6')
+    args = parser.parse_args()
+
+    delta = {key: int(value) for key, value in (part.split('=') for part in args.delta.split(','))}
+    start_date, end_date = batch_run.parse_date_range(args.date_range)
+    generators = {
+        'strptime/relativedelta/strftime': lambda: legacy_dates(start_date, end_date, delta, args.format),
+        'DatePlan without numpy': lambda: without_numpy(plan_dates(args.date_range, delta, args.format))
+    }
+    if batch_run.np is not None:
+        generators['DatePlan with numpy'] = lambda: plan_dates(args.date_range, delta, args.format)
+    for name, generator in generators.items():
+        bench(name, generator())
+    compare({name: generator() for name, generator in generators.items()})
+
+if __name__ == '__main__':
+    main()
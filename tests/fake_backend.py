@@ -0,0 +1,33 @@
+import asyncio
+
+class FakeBackend:
+    #records the containers the runner starts instead of starting them. Containers of images with "fail" in their
+    #name exit with 1 and the others with 0, after delay seconds
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.started = []
+        self.removed = []
+        self.images = {}
+
+    def template(self, image, env_files, variables, mounts, cpus=None, memory=None, command=None):
+        return {"image": image}
+
+    async def run(self, name, template, variables):
+        self.images[name] = template["image"]
+        self.started.append((template["image"], dict(variables)))
+
+    async def wait(self, name):
+        await asyncio.sleep(self.delay)
+        return 1 if "fail" in self.images[name] else 0
+
+    async def pull(self, image):
+        pass
+
+    async def inspect_image(self, image):
+        return {"Id": "sha256:" + "cd" * 32, "RepoDigests": [image.split(":")[0] + "@sha256:" + "ab" * 32]}
+
+    async def remove(self, *names, force=False):
+        self.removed.extend(names)
+
+    async def close(self):
+        pass
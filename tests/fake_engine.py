@@ -0,0 +1,63 @@
+import asyncio
+import json
+import os
+import tempfile
+
+class FakeEngine:
+    #a minimal docker engine on a unix socket for the api backend. Each request is answered by the handler, which
+    #returns the status and a JSON serializable body or bytes. With close_idle set the engine closes every connection
+    #right after its response, like a daemon dropping idle keep-alive connections, without saying so in the headers
+    def __init__(self, handler, close_idle=False):
+        self.handler = handler
+        self.close_idle = close_idle
+        self.requests = []
+        self.connections = 0
+        self.directory = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.directory.name, "docker.sock")
+        self.server = None
+
+    @property
+    def endpoint(self):
+        return f"unix://{self.socket_path}"
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_unix_server(self.serve, self.socket_path)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.server.close()
+        await self.server.wait_closed()
+        self.directory.cleanup()
+
+    async def serve(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line == b"\r\n":
+                        break
+                    key, _, value = line.decode().partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                data = await reader.readexactly(int(headers.get("content-length", 0)))
+                body = json.loads(data) if data else None
+                self.requests.append((method, path, body))
+                status, response = self.handler(method, path, body)
+                if not isinstance(response, bytes):
+                    response = json.dumps(response).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(response)}\r\n\r\n".encode() + response
+                )
+                await writer.drain()
+                if self.close_idle:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
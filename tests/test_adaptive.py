@@ -0,0 +1,60 @@
+import batch_run
+from fake_backend import FakeBackend
+
+def make_controller(local=False, **options):
+    steps = batch_run.compile_steps([{"container": "img/a", "envs": {}}])
+    host = batch_run.Host("local", FakeBackend(), steps, 32, local=local)
+    return batch_run.AdaptiveController(host, {"interval": 60, **options})
+
+def interval(controller, completed, failed=0, saturated=True):
+    #what the controller sees at the end of one interval
+    controller.completed = completed
+    controller.failed = failed
+    controller.host.running.saturated = saturated
+    controller.adjust()
+    return controller.host.running.limit
+
+def test_slow_start_doubles_then_grows_by_one():
+    controller = make_controller(max=6)
+    assert controller.host.running.limit == 1
+    assert [interval(controller, completed) for completed in (10, 20, 40)] == [2, 4, 6]
+    controller = make_controller()
+    interval(controller, 10)
+    controller.slow_start = False
+    assert interval(controller, 20) == 3
+
+def test_limit_stays_when_slots_are_idle():
+    controller = make_controller()
+    assert interval(controller, 10) == 2
+    assert interval(controller, 20, saturated=False) == 2
+
+def test_rollback_when_raising_lowered_the_throughput():
+    controller = make_controller()
+    assert interval(controller, 10) == 2
+    assert interval(controller, 20) == 4
+    #the last raise made things slower, so the limit steps back and slow start ends
+    assert interval(controller, 15) == 2
+    assert not controller.slow_start
+    assert interval(controller, 15) == 3
+
+def test_backoff_on_failures():
+    controller = make_controller()
+    for completed in (10, 20, 40, 80):
+        interval(controller, completed)
+    assert controller.host.running.limit == 16
+    assert interval(controller, 80, failed=40) == 8
+    assert not controller.slow_start
+
+def test_backoff_on_pressure_on_local_hosts(monkeypatch):
+    pressure = {"cpu": 0.0, "memory": 0.0}
+    monkeypatch.setattr(batch_run, "read_pressure", lambda: pressure)
+    monkeypatch.setattr(batch_run.os, "getloadavg", lambda: (0.0, 0.0, 0.0))
+    controller = make_controller(local=True, min=2)
+    assert [interval(controller, completed) for completed in (10, 20, 40)] == [4, 8, 16]
+    pressure["cpu"] = 60.0
+    assert [interval(controller, 40) for _ in range(4)] == [8, 4, 2, 2]
+
+def test_remote_hosts_ignore_local_pressure(monkeypatch):
+    monkeypatch.setattr(batch_run, "read_pressure", lambda: {"cpu": 60.0})
+    controller = make_controller(local=False)
+    assert interval(controller, 10) == 2
@@ -0,0 +1,56 @@
+import asyncio
+import subprocess
+
+import pytest
+
+import batch_run
+
+ENV_FILES = [("/etc/step.env", {"CUSTOM_DATE": "from-env-file", "API_TOKEN": "s3cr3t"})]
+VARIABLES = {"OTHER": "1"}
+DATE = {"CUSTOM_DATE": "2024-01-01"}
+
+def test_cli_run_date_overrides_env():
+    backend = batch_run.DockerCLIBackend()
+    calls = []
+    async def docker(*args, capture=False):
+        calls.append(args)
+    backend.docker = docker
+    template = backend.template("image", ENV_FILES, VARIABLES, [], command=["sh", "-c", "true"])
+    asyncio.run(backend.run("name", template, DATE))
+    args = calls[0]
+    #docker gives -e precedence over --env-file, and among repeated -e options the last one wins
+    values = [args[i + 1] for i, arg in enumerate(args) if arg == "-e" and args[i + 1].startswith("CUSTOM_DATE=")]
+    assert values[-1] == "CUSTOM_DATE=2024-01-01"
+    assert "--env-file=/etc/step.env" in args
+    assert "OTHER=1" in args
+    assert args[-3:] == ("image", "-c", "true")
+
+def test_cli_keeps_env_file_values_off_the_command_line():
+    template = batch_run.DockerCLIBackend().template("image", ENV_FILES, {}, [])
+    assert not any("s3cr3t" in arg for arg in template["args"])
+    assert "env" not in template
+
+def test_cli_failure_does_not_report_arguments():
+    backend = batch_run.DockerCLIBackend()
+    backend.command = ["sh", "-c", "exit 3", "docker"]
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        asyncio.run(backend.docker("run", "-e", "API_TOKEN=s3cr3t", "image"))
+    reason = batch_run.failure_reason(e.value)
+    assert reason == "docker run exited with code 3"
+    assert "s3cr3t" not in str(e.value)
+
+def test_api_run_date_overrides_env():
+    backend = batch_run.DockerAPIBackend("unix:///nonexistent.sock")
+    bodies = []
+    async def request(method, path, query=None, body=None, raw=False):
+        if path == "/containers/create":
+            bodies.append(body)
+        return {}
+    backend.request = request
+    template = backend.template("image", ENV_FILES, VARIABLES, [])
+    asyncio.run(backend.run("name", template, DATE))
+    env = bodies[0]["Env"]
+    assert "CUSTOM_DATE=2024-01-01" in env
+    assert "CUSTOM_DATE=from-env-file" not in env
+    assert "API_TOKEN=s3cr3t" in env
+    assert "OTHER=1" in env
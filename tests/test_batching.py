@@ -0,0 +1,20 @@
+from datetime import datetime, timedelta
+
+import batch_run
+
+def make_runner():
+    return batch_run.BatchRunner([], [], date_key=lambda date: datetime.strptime(date, "%Y-%m-%d"), date_step=timedelta(days=1))
+
+def test_contiguous_batch():
+    assert make_runner().contiguous(["2024-01-01", "2024-01-02", "2024-01-03"])
+
+def test_batch_with_gap_is_not_contiguous():
+    assert not make_runner().contiguous(["2024-01-01", "2024-01-03"])
+
+def test_batch_without_plan_step_is_not_contiguous():
+    assert not batch_run.BatchRunner([], []).contiguous(["2024-01-01", "2024-01-02"])
+
+def test_describe_single_date_batch():
+    assert batch_run.describe_dates(["2024-01-01"]) == "CUSTOM_DATE=2024-01-01"
+    assert batch_run.describe_dates(["2024-01-01"], batched=True) == "CUSTOM_DATES=2024-01-01"
+    assert batch_run.describe_dates(["2024-01-01", "2024-01-03"], batched=True) == "CUSTOM_DATES=2024-01-01 to 2024-01-03 (2 dates)"
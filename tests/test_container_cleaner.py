@@ -0,0 +1,56 @@
+import asyncio
+
+import batch_run
+from fake_backend import FakeBackend
+
+def clean(finished, pause=0, **options):
+    #adds the finished (name, exit code) containers in order, then closes the cleaner
+    backend = FakeBackend()
+    async def run():
+        cleaner = batch_run.ContainerCleaner(backend, **options)
+        for name, exit_code in finished:
+            cleaner.add(name, exit_code)
+        await asyncio.sleep(pause)
+        removed = list(backend.removed)
+        await cleaner.close()
+        return cleaner, removed
+    cleaner, removed = asyncio.run(run())
+    return removed, [name for _, name in cleaner.retained], [name for _, name in cleaner.failed]
+
+def test_keeps_the_most_recent_containers():
+    removed, retained, _ = clean([("a", 0), ("b", 1), ("c", 0), ("d", 0)], max_stored=2)
+    assert sorted(removed) == ["a", "b"]
+    assert retained == ["c", "d"]
+
+def test_removes_in_the_background_before_close():
+    removed, _, _ = clean([("a", 0), ("b", 0), ("c", 0)], pause=0.05, max_stored=1)
+    assert sorted(removed) == ["a", "b"]
+
+def test_removes_containers_older_than_max_age():
+    removed, retained, _ = clean([("a", 0), ("b", 0)], pause=0.2, max_age=0.05)
+    assert sorted(removed) == ["a", "b"]
+    assert retained == []
+
+def test_keeps_everything_by_default():
+    removed, retained, _ = clean([("a", 0), ("b", 1)])
+    assert removed == []
+    assert retained == ["a", "b"]
+
+def test_keep_failures_removes_successful_containers_right_away():
+    removed, retained, failed = clean([("a", 0), ("b", 1), ("c", 0)], pause=0.05, keep="failures")
+    assert sorted(removed) == ["a", "c"]
+    assert failed == ["b"]
+
+def test_max_failed_keeps_failures_apart_from_successes():
+    finished = [("f1", 1), ("f2", 2), ("a", 0), ("b", 0), ("c", 0), ("f3", 1)]
+    removed, retained, failed = clean(finished, max_stored=1, max_failed=2)
+    #the successful runs cannot push the failed ones out, only newer failures can
+    assert sorted(removed) == ["a", "b", "f1"]
+    assert retained == ["c"]
+    assert failed == ["f2", "f3"]
+
+def test_max_failed_with_keep_failures():
+    removed, retained, failed = clean([("f1", 1), ("a", 0), ("f2", 1), ("f3", 1)], keep="failures", max_failed=1)
+    assert sorted(removed) == ["a", "f1", "f2"]
+    assert retained == []
+    assert failed == ["f3"]
@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime
+
+import batch_run
+
+def day(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+def run_batcher(size, arrivals, key=None):
+    batches = []
+    async def run():
+        async def execute(dates):
+            batches.append(dates)
+            return len(dates)
+        batcher = batch_run.DateBatcher(size, execute, key)
+        for date in arrivals:
+            batcher.admit(date)
+        async def through(date):
+            #like the runner, a date gets past the step once its batch has run
+            result = await batcher.add(date)
+            batcher.passed(date)
+            return result
+        tasks = [asyncio.create_task(through(date)) for date in arrivals]
+        await asyncio.sleep(0)
+        batcher.finish()
+        return await asyncio.gather(*tasks)
+    return asyncio.run(run()), batches
+
+def test_batcher_flushes_full_and_final_batches():
+    results, batches = run_batcher(2, ["a", "b", "c"])
+    assert batches == [["a", "b"], ["c"]]
+    assert results == [2, 2, 1]
+
+def test_batcher_passes_dates_in_key_order():
+    _, batches = run_batcher(3, ["2024-01-03", "2024-01-01", "2024-01-02"], key=day)
+    assert batches == [["2024-01-01", "2024-01-02", "2024-01-03"]]
+
+def test_batcher_waits_for_pending_dates():
+    batches = []
+    async def run():
+        async def execute(dates):
+            batches.append(dates)
+        batcher = batch_run.DateBatcher(3, execute)
+        batcher.admit("a")
+        batcher.admit("b")
+        batcher.finish()
+        task = asyncio.create_task(batcher.add("a"))
+        await asyncio.sleep(0)
+        #b has not reached the step yet, so the batch is still open
+        assert batches == []
+        batcher.passed("b")
+        await task
+    asyncio.run(run())
+    assert batches == [["a"]]
+
+def test_batcher_holds_running_batches():
+    async def run():
+        started = asyncio.Event()
+        release = asyncio.Event()
+        async def execute(dates):
+            started.set()
+            await release.wait()
+            return dates
+        batcher = batch_run.DateBatcher(1, execute)
+        batcher.admit("a")
+        waiter = asyncio.create_task(batcher.add("a"))
+        await started.wait()
+        held = len(batcher.tasks)
+        release.set()
+        result = await waiter
+        await asyncio.sleep(0)
+        return held, result, len(batcher.tasks)
+    assert asyncio.run(run()) == (1, ["a"], 0)
@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import batch_run
+
+np = pytest.importorskip("numpy")
+
+FORMATS = ["%Y-%m-%d", "%Y%m%d", "%m/%d/%Y", "%Y-%j", "%Y-%m-%dT%H", "%Y-%m-%d %H:%M:%S", "%d.%m.%y %%"]
+
+def strftime_dates(start_date, end_date, step, date_format):
+    return [(date, date.strftime(date_format)) for date in batch_run.generate_dates(start_date, end_date, step)]
+
+@pytest.mark.parametrize("date_format", FORMATS)
+@pytest.mark.parametrize("step", [timedelta(hours=1), timedelta(days=1), timedelta(days=3, minutes=7)])
+def test_numpy_dates_match_strftime(date_format, step):
+    start_date = datetime(2023, 12, 30, 22)
+    #an end off the grid of the step, crossing a year and a leap day
+    end_date = datetime(2024, 3, 2, 5, 30)
+    expected = strftime_dates(start_date, end_date, step, date_format)
+    #small chunks so the dates cross chunk boundaries
+    assert list(batch_run.generate_dates_numpy(start_date, end_date, step, date_format, chunk_size=7)) == expected
+
+def test_iso_columns_falls_back_for_other_fields():
+    assert batch_run.iso_columns("%Y-%j") is None
+    assert batch_run.iso_columns("%Y%m%d") == [0, 1, 2, 3, 5, 6, 8, 9]
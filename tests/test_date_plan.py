@@ -0,0 +1,22 @@
+from datetime import datetime
+
+import batch_run
+
+def day(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+def test_normalize_merges_overlapping_and_adjacent_ranges():
+    plan = batch_run.DatePlan([], [], {"days": 1}, "%Y-%m-%d")
+    merged = plan.normalize([(day("2024-01-05"), day("2024-01-10")), (day("2024-01-01"), day("2024-01-06")), (day("2024-01-11"), day("2024-01-12"))])
+    assert merged == [[day("2024-01-01"), day("2024-01-12")]]
+    assert plan.duplicates == 2
+
+def test_normalize_keeps_ranges_off_the_grid_apart():
+    plan = batch_run.DatePlan([], [], {"days": 2}, "%Y-%m-%d")
+    merged = plan.normalize([(day("2024-01-01"), day("2024-01-09")), (day("2024-01-02"), day("2024-01-04")), (day("2024-01-10"), day("2024-01-08"))])
+    assert merged == [[day("2024-01-01"), day("2024-01-09")], [day("2024-01-02"), day("2024-01-04")]]
+    assert plan.duplicates == 0
+
+def test_plan_runs_listed_dates_once():
+    plan = batch_run.DatePlan(["2024-01-02", "2024-02-01"], ["2024-01-01_2024-01-03", "2024-01-02_2024-01-04"], {"days": 1}, "%Y-%m-%d")
+    assert list(plan) == ["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04", "2024-02-01"]
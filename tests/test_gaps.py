@@ -0,0 +1,50 @@
+import json
+
+import batch_run
+
+def make_journal(tmp_path, completed):
+    path = tmp_path / "journal.jsonl"
+    with open(path, "w") as f:
+        for date, step_id, exit_code in completed:
+            f.write(json.dumps({"date": date, "step": step_id, "container": "img", "image": "img", "name": "c", "exit_code": exit_code, "duration": 1}) + "\n")
+    return str(path)
+
+def labels(intervals):
+    return [(batch_run.interval_label(interval), interval[4]) for interval in intervals]
+
+def test_gaps_per_step_from_journal_and_outputs(tmp_path):
+    steps = batch_run.compile_steps([
+        {"container": "img/a", "envs": {}},
+        {"container": "img/b", "envs": {}, "outputs": str(tmp_path / "{date}.out")}
+    ])
+    plan = batch_run.DatePlan(["2024-01-20"], ["2024-01-01_2024-01-06"], {"days": 1}, "%Y-%m-%d")
+    journal = batch_run.Journal(make_journal(tmp_path, [
+        ("2024-01-01", "0", 0), ("2024-01-02", "0", 0), ("2024-01-03", "0", 1), ("2024-01-05", "0", 0), ("2024-01-20", "0", 0)
+    ]), readonly=True)
+    for date in ("2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04", "2024-01-20"):
+        (tmp_path / f"{date}.out").write_text("")
+    gaps = batch_run.find_gaps(plan, steps, journal, batch_run.OutputChecker("%Y-%m-%d"))
+    #a failed run does not count as done
+    assert labels(gaps["0"]) == [("2024-01-03_2024-01-04", 2), ("2024-01-06", 1)]
+    assert labels(gaps["1"]) == [("2024-01-05_2024-01-06", 2)]
+    assert labels(gaps[None]) == [("2024-01-03_2024-01-06", 4)]
+
+def test_no_gaps_without_missing_dates(tmp_path):
+    steps = batch_run.compile_steps([{"container": "img/a", "envs": {}}])
+    plan = batch_run.DatePlan([], ["2024-01-01_2024-01-02"], {"days": 1}, "%Y-%m-%d")
+    journal = batch_run.Journal(make_journal(tmp_path, [("2024-01-01", "0", 0), ("2024-01-02", "0", 0)]), readonly=True)
+    assert batch_run.find_gaps(plan, steps, journal) == {"0": [], None: []}
+
+def test_gaps_command_writes_the_missing_dates(tmp_path, capsys):
+    config = tmp_path / "config.json"
+    journal = make_journal(tmp_path, [("2024-01-02", "0", 0), ("2024-01-03", "0", 0)])
+    config.write_text(json.dumps({
+        "run_data": [{"container": "img/a", "envs": {}}],
+        "dates": ["2024-02-01"], "date_ranges": ["2024-01-01_2024-01-06"], "journal": journal
+    }))
+    output = tmp_path / "gaps.json"
+    batch_run.gaps_main([str(config), "--output", str(output)])
+    gap_data = json.loads(output.read_text())
+    assert gap_data["dates"] == ["2024-01-01", "2024-02-01"]
+    assert gap_data["date_ranges"] == ["2024-01-04_2024-01-06"]
+    assert "5 missing dates in 3 intervals" in capsys.readouterr().out
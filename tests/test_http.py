@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+import batch_run
+from fake_engine import FakeEngine
+
+def read_response(data):
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        status, headers = await batch_run.read_http_head(reader)
+        body = b"".join([chunk async for chunk in batch_run.iter_http_body(reader, status, headers)])
+        return status, headers, body
+    return asyncio.run(read())
+
+def test_content_length_body():
+    status, headers, body = read_response(b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\nX-Test: a: b\r\n\r\nhello")
+    assert status == 200
+    assert headers["x-test"] == "a: b"
+    assert body == b"hello"
+
+def test_chunked_body():
+    status, _, body = read_response(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5;ext=1\r\nhello\r\n6\r\n world\r\n0\r\n\r\n")
+    assert status == 200
+    assert body == b"hello world"
+
+def test_body_until_close():
+    _, headers, body = read_response(b"HTTP/1.1 200 OK\r\n\r\nuntil eof")
+    assert body == b"until eof"
+    assert headers["connection"] == "close"
+
+def test_no_content():
+    status, _, body = read_response(b"HTTP/1.1 204 No Content\r\n\r\n")
+    assert status == 204
+    assert body == b""
+
+def test_truncated_body():
+    with pytest.raises(asyncio.IncompleteReadError):
+        read_response(b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nshort")
+
+def frame(stream, payload):
+    return bytes([stream, 0, 0, 0]) + len(payload).to_bytes(4, "big") + payload
+
+def test_demux_frames_split_across_chunks():
+    data = frame(1, b"out") + frame(2, b"err") + frame(1, b"")
+    async def demux():
+        async def chunks():
+            #every byte in a chunk of its own, so headers and payloads are split anywhere
+            for i in range(len(data)):
+                yield data[i:i + 1]
+        return [item async for item in batch_run.demux_docker_stream(chunks())]
+    assert asyncio.run(demux()) == [(1, b"out"), (2, b"err"), (1, b"")]
+
+def test_request_reuses_connection():
+    async def run():
+        async with FakeEngine(lambda method, path, body: (200, {"path": path})) as engine:
+            backend = batch_run.DockerAPIBackend(engine.endpoint)
+            assert await backend.request("GET", "/info") == {"path": "/info"}
+            assert await backend.request("GET", "/version") == {"path": "/version"}
+            await backend.close()
+            return engine.connections
+    assert asyncio.run(run()) == 1
+
+def test_request_retries_idle_closed_connection():
+    async def run():
+        async with FakeEngine(lambda method, path, body: (200, {}), close_idle=True) as engine:
+            backend = batch_run.DockerAPIBackend(engine.endpoint)
+            await backend.request("GET", "/info")
+            #let the engine close the pooled connection
+            await asyncio.sleep(0.05)
+            await backend.request("POST", "/containers/create", {"name": "a"}, {"Image": "image"})
+            await backend.close()
+            return engine
+    engine = asyncio.run(run())
+    assert engine.connections == 2
+    assert [path for _, path, _ in engine.requests] == ["/info", "/containers/create?name=a"]
+
+def test_request_error_status():
+    async def run():
+        async with FakeEngine(lambda method, path, body: (404, {"message": "no such image"})) as engine:
+            backend = batch_run.DockerAPIBackend(engine.endpoint)
+            try:
+                await backend.request("GET", "/images/missing/json")
+            finally:
+                await backend.close()
+    with pytest.raises(batch_run.DockerAPIError) as e:
+        asyncio.run(run())
+    assert e.value.status == 404
+
+def test_request_lost_connection_raises_os_error():
+    async def run():
+        async def serve(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nshort")
+            writer.close()
+        engine = FakeEngine(None)
+        server = await asyncio.start_unix_server(serve, engine.socket_path)
+        try:
+            await batch_run.DockerAPIBackend(engine.endpoint).request("GET", "/info")
+        finally:
+            server.close()
+            engine.directory.cleanup()
+    with pytest.raises(OSError):
+        asyncio.run(run())
+
+def test_split_reference():
+    assert batch_run.split_reference("busybox") == ("busybox", "latest")
+    assert batch_run.split_reference("ghcr.io/org/task:1.2") == ("ghcr.io/org/task", "1.2")
+    assert batch_run.split_reference("localhost:5000/task") == ("localhost:5000/task", "latest")
+    assert batch_run.split_reference("task@sha256:abcd") == ("task", "sha256:abcd")
+
+def test_pull_passes_a_tag():
+    async def run():
+        async with FakeEngine(lambda method, path, body: (200, b'{"status":"done"}\n')) as engine:
+            backend = batch_run.DockerAPIBackend(engine.endpoint)
+            await backend.pull("localhost:5000/task")
+            await backend.close()
+            return engine.requests
+    assert [path for _, path, _ in asyncio.run(run())] == ["/images/create?fromImage=localhost%3A5000%2Ftask&tag=latest"]
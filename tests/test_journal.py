@@ -0,0 +1,58 @@
+import asyncio
+
+import batch_run
+from fake_backend import FakeBackend
+
+def test_reads_completed_runs_and_durations(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = batch_run.Journal(path)
+    journal.record("2024-01-01", "0", "img/a", "img/a@sha256:ab", "c1", 0, 2)
+    journal.record("2024-01-01", "1", "img/b", "img/b@sha256:cd", "c2", 0, 3)
+    journal.record("2024-01-02", "0", "img/a", "img/a@sha256:ab", "c3", 0, 4)
+    journal.record("2024-01-02", "1", "img/b", "img/b@sha256:cd", "c4", 1, 5)
+    journal.close()
+    journal = batch_run.Journal(path, readonly=True)
+    assert journal.is_completed("2024-01-01", "1")
+    assert not journal.is_completed("2024-01-02", "1")
+    assert journal.completed_dates(["0", "1"]) == ["2024-01-01"]
+    assert sorted(journal.completed_dates(["0"])) == ["2024-01-01", "2024-01-02"]
+    #the failed run still counts towards how long the date takes
+    assert journal.date_durations() == {"2024-01-01": 5, "2024-01-02": 9}
+
+def test_partial_last_line_is_ignored(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    journal = batch_run.Journal(str(path))
+    journal.record("2024-01-01", "0", "img/a", "img/a", "c1", 0, 1)
+    journal.close()
+    with open(path, "a") as f:
+        f.write('{"date": "2024-01-02", "step": "0", "exit')
+    journal = batch_run.Journal(str(path))
+    assert journal.completed == {("2024-01-01", "0")}
+    journal.record("2024-01-03", "0", "img/a", "img/a", "c2", 0, 1)
+    journal.close()
+    #the next record starts on a line of its own
+    journal = batch_run.Journal(str(path), readonly=True)
+    assert journal.completed == {("2024-01-01", "0"), ("2024-01-03", "0")}
+
+def test_resume_skips_completed_steps(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    def run(run_data, resume):
+        steps = batch_run.compile_steps(run_data)
+        backend = FakeBackend()
+        host = batch_run.Host("local", backend, steps, 2, batch_run.ResourcePool(4, 1 << 30), False)
+        journal = batch_run.Journal(path)
+        runner = batch_run.BatchRunner(steps, [host], pull=False, journal=journal, resume=resume)
+        try:
+            asyncio.run(runner.run_dates(iter(["2024-01-01", "2024-01-02"])))
+        except batch_run.RunFailedError:
+            pass
+        journal.close()
+        return sorted((variables["CUSTOM_DATE"], image) for image, variables in backend.started)
+    assert run([{"container": "img/a", "envs": {}}, {"container": "img/fail", "envs": {}}], False) == [
+        ("2024-01-01", "img/a"), ("2024-01-01", "img/fail"), ("2024-01-02", "img/a"), ("2024-01-02", "img/fail")
+    ]
+    #only the failed step is run again
+    assert run([{"container": "img/a", "envs": {}}, {"container": "img/b", "envs": {}}], True) == [
+        ("2024-01-01", "img/b"), ("2024-01-02", "img/b")
+    ]
+    assert run([{"container": "img/a", "envs": {}}, {"container": "img/b", "envs": {}}], True) == []
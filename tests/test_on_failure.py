@@ -0,0 +1,32 @@
+import asyncio
+from time import monotonic
+
+import batch_run
+from fake_backend import FakeBackend
+
+DATES = ["2024-07-01", "2024-07-02", "2024-07-03", "2024-07-04"]
+
+def run(run_data, max_parallel, pipeline=False):
+    steps = batch_run.compile_steps(run_data)
+    backend = FakeBackend()
+    host = batch_run.Host("local", backend, steps, max_parallel, batch_run.ResourcePool(4, 1 << 30), pipeline)
+    runner = batch_run.BatchRunner(steps, [host], pull=False, on_failure="abort")
+    try:
+        asyncio.run(runner.run_dates(iter(DATES)))
+    except batch_run.RunFailedError:
+        pass
+    return backend.started
+
+def test_abort_cancels_runs_waiting_for_a_slot():
+    started = run([{"container": "img/fail", "envs": {}}, {"container": "img/b", "envs": {}}], 1, pipeline=True)
+    #the second date was admitted into the window but has to wait for the first step's slot
+    assert started == [("img/fail", {"CUSTOM_DATE": "2024-07-01"})]
+
+def test_abort_cancels_retry_backoff():
+    start = monotonic()
+    started = run([
+        {"container": "img/fail-later", "envs": {}, "retries": 1, "backoff": 60, "on_failure": "continue"},
+        {"container": "img/fail", "envs": {}, "depends_on": []}
+    ], 1)
+    assert monotonic() - start < 10
+    assert [image for image, _ in started].count("img/fail-later") == 1
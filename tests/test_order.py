@@ -0,0 +1,39 @@
+import pytest
+
+import batch_run
+
+DATES = [f"2024-01-{day:02d}" for day in range(1, 10)]
+
+def plan():
+    return batch_run.DatePlan([], ["2024-01-01_2024-01-09"], {"days": 1}, "%Y-%m-%d")
+
+@pytest.mark.parametrize("n", [0, 1, 2, 3, 9, 100])
+def test_bisecting_order_is_a_permutation(n):
+    assert sorted(batch_run.bisecting_order(n)) == list(range(n))
+
+def test_bisecting_order_covers_the_plan_evenly():
+    assert list(batch_run.bisecting_order(9)) == [0, 8, 4, 2, 6, 1, 3, 5, 7]
+
+def test_chronological_order_is_lazy():
+    dates = batch_run.order_dates(plan(), "chronological")
+    assert not isinstance(dates, list)
+    assert list(dates) == DATES
+
+@pytest.mark.parametrize("order", ["reverse", "newest-first"])
+def test_reverse_order(order):
+    assert list(batch_run.order_dates(plan(), order)) == DATES[::-1]
+
+@pytest.mark.parametrize("order", ["interleaved", "bisecting"])
+def test_interleaved_order(order):
+    assert list(batch_run.order_dates(plan(), order)) == [DATES[i] for i in [0, 8, 4, 2, 6, 1, 3, 5, 7]]
+
+def test_longest_first_order_estimates_unknown_dates_with_the_average():
+    durations = {"2024-01-02": 30, "2024-01-05": 10, "2024-01-07": 50}
+    dates = list(batch_run.order_dates(plan(), "longest-first", durations))
+    #the dates without a duration are expected to take the average of 30 seconds, and keep their order
+    assert dates[:1] == ["2024-01-07"]
+    assert dates[1:8] == ["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04", "2024-01-06", "2024-01-08", "2024-01-09"]
+    assert dates[8:] == ["2024-01-05"]
+
+def test_longest_first_order_without_durations_keeps_the_plan_order():
+    assert list(batch_run.order_dates(plan(), "longest-first", {})) == DATES
@@ -0,0 +1,55 @@
+import os
+
+import batch_run
+
+def make_step(tmp_path, outputs, inputs=()):
+    return batch_run.compile_steps([{
+        "container": "img/a", "envs": {},
+        "outputs": [str(tmp_path / path) for path in outputs],
+        "inputs": [str(tmp_path / path) for path in inputs]
+    }])[0]
+
+def touch(path, mtime):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("")
+    os.utime(path, (mtime, mtime))
+
+def test_outputs_formatted_with_the_date(tmp_path):
+    step = make_step(tmp_path, ["{date:%Y}/{date}.tif"])
+    touch(tmp_path / "2024" / "2024-01-01.tif", 100)
+    checker = batch_run.OutputChecker("%Y-%m-%d")
+    assert checker.up_to_date("2024-01-01", step)
+    assert not checker.up_to_date("2024-01-02", step)
+
+def test_missing_or_outdated_outputs(tmp_path):
+    step = make_step(tmp_path, ["out/{date}.a", "out/{date}.b"], ["in/{date}.csv"])
+    touch(tmp_path / "in" / "2024-01-01.csv", 200)
+    touch(tmp_path / "out" / "2024-01-01.a", 300)
+    checker = batch_run.OutputChecker("%Y-%m-%d")
+    assert not checker.up_to_date("2024-01-01", step)
+    touch(tmp_path / "out" / "2024-01-01.b", 150)
+    checker = batch_run.OutputChecker("%Y-%m-%d")
+    #one output is older than the input
+    assert not checker.up_to_date("2024-01-01", step)
+    touch(tmp_path / "out" / "2024-01-01.b", 200)
+    checker = batch_run.OutputChecker("%Y-%m-%d")
+    assert checker.up_to_date("2024-01-01", step)
+
+def test_missing_input_is_not_up_to_date(tmp_path):
+    step = make_step(tmp_path, ["{date}.out"], ["{date}.in"])
+    touch(tmp_path / "2024-01-01.out", 100)
+    assert not batch_run.OutputChecker("%Y-%m-%d").up_to_date("2024-01-01", step)
+
+def test_steps_without_outputs_always_run(tmp_path):
+    step = make_step(tmp_path, [])
+    assert not batch_run.OutputChecker("%Y-%m-%d").up_to_date("2024-01-01", step)
+
+def test_invalidate_lists_the_directory_again(tmp_path):
+    step = make_step(tmp_path, ["{date}.out"])
+    checker = batch_run.OutputChecker("%Y-%m-%d")
+    assert not checker.up_to_date("2024-01-01", step)
+    touch(tmp_path / "2024-01-01.out", 100)
+    #the cached listing is still used until a run of the step invalidates it
+    assert not checker.up_to_date("2024-01-01", step)
+    checker.invalidate(["2024-01-01"], step)
+    assert checker.up_to_date("2024-01-01", step)
@@ -0,0 +1,40 @@
+import asyncio
+import json
+
+import pytest
+
+import batch_run
+from fake_backend import FakeBackend
+
+class UnreachableBackend:
+    async def pull(self, image):
+        raise ConnectionRefusedError(111, "Connection refused")
+
+    async def inspect_image(self, image):
+        raise ConnectionRefusedError(111, "Connection refused")
+
+def test_unreachable_daemon_fails_the_run():
+    host = batch_run.Host("local", UnreachableBackend(), [], 1)
+    runner = batch_run.BatchRunner([{"id": 0, "container": "image", "batch_size": 1}], [host])
+    with pytest.raises(batch_run.RunFailedError):
+        asyncio.run(runner.pin_images())
+
+def test_missing_docker_cli_fails_the_run():
+    backend = batch_run.DockerCLIBackend()
+    backend.command = ["/nonexistent/docker"]
+    host = batch_run.Host("local", backend, [], 1)
+    runner = batch_run.BatchRunner([{"id": 0, "container": "image", "batch_size": 1}], [host])
+    with pytest.raises(batch_run.RunFailedError):
+        asyncio.run(runner.pin_images())
+
+def test_journal_and_metrics_record_the_pinned_image(tmp_path):
+    steps = batch_run.compile_steps([{"container": "img/a:1.0", "envs": {}}])
+    host = batch_run.Host("local", FakeBackend(), steps, 1, batch_run.ResourcePool(1, 1 << 30))
+    journal = batch_run.Journal(str(tmp_path / "journal.jsonl"))
+    metrics = batch_run.Metrics(str(tmp_path / "metrics.jsonl"))
+    runner = batch_run.BatchRunner(steps, [host], journal=journal, metrics=metrics)
+    asyncio.run(runner.run_dates(iter(["2024-07-01"])))
+    pinned = "img/a@sha256:" + "ab" * 32
+    for path in ("journal.jsonl", "metrics.jsonl"):
+        record = json.loads((tmp_path / path).read_text())
+        assert (record["container"], record["image"]) == ("img/a:1.0", pinned)
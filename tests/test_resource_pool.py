@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+import batch_run
+
+def test_resource_pool_lets_small_runs_overtake():
+    async def run():
+        pool = batch_run.ResourcePool(4, 100)
+        await pool.acquire(3, 10)
+        large = asyncio.create_task(pool.acquire(2, 10))
+        small = asyncio.create_task(pool.acquire(1, 10))
+        await asyncio.sleep(0)
+        assert small.done() and not large.done()
+        pool.release(3, 10)
+        await asyncio.sleep(0)
+        assert large.done()
+        assert (pool.free_cpus, pool.free_memory) == (1, 80)
+    asyncio.run(run())
+
+def test_resource_pool_reserves_for_a_run_bypassed_too_often():
+    async def run():
+        pool = batch_run.ResourcePool(2, 100)
+        await pool.acquire(1, 0)
+        large = asyncio.create_task(pool.acquire(2, 0))
+        await asyncio.sleep(0)
+        for _ in range(pool.MAX_BYPASS):
+            await pool.acquire(1, 0)
+            pool.release(1, 0)
+        blocked = asyncio.create_task(pool.acquire(1, 0))
+        await asyncio.sleep(0)
+        assert not blocked.done()
+        pool.release(1, 0)
+        await asyncio.sleep(0)
+        assert large.done() and not blocked.done()
+        blocked.cancel()
+    asyncio.run(run())
+
+def test_resource_pool_cancelled_waiter_gives_nothing_back():
+    async def run():
+        pool = batch_run.ResourcePool(1, 100)
+        await pool.acquire(1, 0)
+        waiter = asyncio.create_task(pool.acquire(1, 0))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        assert pool.waiters == []
+        pool.release(1, 0)
+        assert pool.free_cpus == 1
+    asyncio.run(run())
+
+def test_parse_memory_accepts_docker_sizes():
+    assert batch_run.parse_memory(1024) == 1024
+    assert batch_run.parse_memory("512m") == 512 << 20
+    assert batch_run.parse_memory("8gb") == 8 << 30
+    assert batch_run.parse_memory("512MiB") == 512 << 20
+    assert batch_run.parse_memory("1.5g") == 3 << 29
+    assert batch_run.parse_memory("2 GiB") == 2 << 30
+
+def test_parse_memory_rejects_unknown_sizes():
+    with pytest.raises(ValueError):
+        batch_run.parse_memory("8gbx")
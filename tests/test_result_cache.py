@@ -0,0 +1,58 @@
+import asyncio
+import os
+
+import batch_run
+from fake_backend import FakeBackend
+
+def make_cache(tmp_path, max_entries):
+    return batch_run.ResultCache(str(tmp_path / "cache"), max_entries)
+
+def stored(tmp_path):
+    return sorted(name[:-len(".json")] for name in os.listdir(tmp_path / "cache"))
+
+def test_key_depends_on_everything_that_goes_into_the_run():
+    key = batch_run.ResultCache.make_key("sha256:ab", {"CUSTOM_DATE": "2024-01-01"}, ["d1"], [("/src", "/dst")])
+    assert key == batch_run.ResultCache.make_key("sha256:ab", {"CUSTOM_DATE": "2024-01-01"}, ["d1"], [["/src", "/dst"]])
+    assert key != batch_run.ResultCache.make_key("sha256:cd", {"CUSTOM_DATE": "2024-01-01"}, ["d1"], [("/src", "/dst")])
+    assert key != batch_run.ResultCache.make_key("sha256:ab", {"CUSTOM_DATE": "2024-01-02"}, ["d1"], [("/src", "/dst")])
+    assert key != batch_run.ResultCache.make_key("sha256:ab", {"CUSTOM_DATE": "2024-01-01"}, ["d2"], [("/src", "/dst")])
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = make_cache(tmp_path, 2)
+    cache.add("a", "2024-01-01", "0", "img")
+    cache.add("b", "2024-01-02", "0", "img")
+    #a hit makes the entry the most recently used
+    assert cache.contains("a")
+    cache.add("c", "2024-01-03", "0", "img")
+    assert stored(tmp_path) == ["a", "c"]
+    assert not cache.contains("b")
+    assert cache.contains("a") and cache.contains("c")
+
+def test_reloads_entries_in_modification_order(tmp_path):
+    cache = make_cache(tmp_path, 3)
+    for mtime, key in [(300, "a"), (100, "b"), (200, "c")]:
+        cache.add(key, "2024-01-01", "0", "img")
+        os.utime(cache.entry_path(key), (mtime, mtime))
+    #a smaller limit evicts the oldest entries on load
+    cache = make_cache(tmp_path, 2)
+    assert list(cache.entries) == ["c", "a"]
+    assert stored(tmp_path) == ["a", "c"]
+
+def test_removed_entry_is_a_miss(tmp_path):
+    cache = make_cache(tmp_path, 2)
+    cache.add("a", "2024-01-01", "0", "img")
+    os.remove(cache.entry_path("a"))
+    assert not cache.contains("a")
+    assert "a" not in cache.entries
+
+def test_cached_runs_are_skipped(tmp_path):
+    def run():
+        steps = batch_run.compile_steps([{"container": "img/a", "envs": {}}])
+        backend = FakeBackend()
+        host = batch_run.Host("local", backend, steps, 2, batch_run.ResourcePool(4, 1 << 30), False)
+        runner = batch_run.BatchRunner(steps, [host], pull=False, cache=make_cache(tmp_path, 10))
+        asyncio.run(runner.run_dates(iter(["2024-01-01", "2024-01-02"])))
+        return backend.started
+    assert len(run()) == 2
+    assert run() == []
+    assert len(stored(tmp_path)) == 2